@@ -0,0 +1,221 @@
+"""
+Benchmark of the extraction pipeline on a synthetic corpus.
+
+Every stage is timed on its own and reported in files/s and records/s, together
+with the peak RSS of the process. The stages do not overlap: extract only pulls
+the raw text out of the pages, and the normalizers (address, phone, email,
+pastor) are timed separately on that raw text. Results can be saved as a baseline, and later
+runs compared against it fail when a stage got slower than the threshold.
+
+Example usage:
+python3 benchmark.py --files 500 --save-baseline bench_baseline.json
+python3 benchmark.py --files 500 --baseline bench_baseline.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import make_acpe_spreadsheet
+import make_cpe_spreadsheet
+import make_updateparishdata_spreadsheet
+import models
+from models import Phone, configure_address_cache, emails_to_people, parse_address, parse_phones
+from output import TsvWriter
+from parsers import PARSERS, make_soup
+
+_STREETS = ["123 Main St, Springfield, IL 62701", "45 Oak Ave, Suite 200, Austin, TX 78701", "9 Elm Road, Boston, MA 02108", "700 W Lake Blvd, Chicago, IL 60601", ""]
+_NAMES = ["John Smith", "Mary Ann Jones", "ROBERT LEE", "Ana de la Cruz", "Paul Kim, MDiv", "Li"]
+_PASTORS = ["Rev. John Smith", "Fr. Bob Jones", "Msgr. Tom Lee, Pastor", "Farther Mike Doe", "(Administrator) Ann Bee", "Very Rev Paul Kim", "Deacon Al X Y", "Most Rev. Dr. Peter Paul Ray", ""]
+
+
+def _phone(rng):
+    return f"({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(1000, 9999)}" + (f" ext {rng.randint(1, 99)}" if rng.random() < 0.2 else "")
+
+def generate_cpe(directory, nfiles, rng):
+    for i in range(nfiles):
+        programs = []
+        for j in range(rng.randint(0, 4)):
+            programs.append(f"""<h3 class="wp-block-heading">Program {i}-{j}</h3>
+<p>Location: {rng.choice(_STREETS)}</p>
+<p>Phone: {_phone(rng)}</p>
+<p>Website: https://example{i}.org</p>
+<p>Email: {rng.choice(["john.smith", "mary_jones", "office"])}{i}@example.org</p>
+<p>Extended: {rng.choice(["Yes", "No"])}</p>""")
+        with open(os.path.join(directory, f"program{i:06d}.html"), "w") as f:
+            f.write(f"<html><head><title>CPE</title></head><body><nav>{'<a href=#>x</a>' * 50}</nav><div>{''.join(programs)}</div><footer>{'<p>footer</p>' * 20}</footer></body></html>")
+
+def generate_acpe(directory, nfiles, rng):
+    for i in range(nfiles):
+        rows = "".join(f"<tr><td>{rng.choice(_NAMES)}</td><td>contact{k}@center{i}.org</td><td>{_phone(rng)}</td></tr>" for k in range(rng.randint(0, 4)))
+        with open(os.path.join(directory, f"{i:06d}.html"), "w") as f:
+            f.write(f"""<html><body><nav>{'<span>nav</span>' * 30}</nav><table><tr><th>Name</th><th>Email</th><th>Phone</th></tr>{rows}</table>
+<div class="card"><div class="card-heading">Program Details</div><div class="card-body"><span><ul>
+<li>Account Name\n Center {i}</li><li>Program Type\n Hospital</li><li>Street\n 1 Way</li><li>City\n Town</li>
+<li>Shipping State/Province Code\n NY</li><li>Zip/Postal Code\n 10001</li><li>Account Phone\n {_phone(rng)}</li>
+<li>Website\n <a href="https://center{i}.org">site</a></li><li>Other Email\n other{i}@center.org</li></ul></span></div></div>
+<footer>{'<div class="card">filler</div>' * 30}</footer></body></html>""")
+
+def generate_updateparishdata(directory, nfiles, rng, records_per_page=20):
+    for i in range(nfiles):
+        records = []
+        for k in range(records_per_page):
+            church_id = rng.randint(1, nfiles * records_per_page // 2)
+            records.append({"id": church_id, "name": f"St. Mary {church_id} - Parish", "church_type_name": "Parish", "diocese_name": "Diocese", "diocese_type_name": "Diocese", "rite_type_name": "Latin", "latitude": str(40 + rng.random()), "longitude": str(-74 + rng.random()), "email": f"office{church_id}@stmary.org", "url": f"https://stmary{church_id}.org", "pastors_name": rng.choice(_PASTORS), "phone": _phone(rng), "last_update": f"2024-0{rng.randint(1, 9)}-01", "language_name": "English", "church_address_city_name": "City", "church_address_providence_name": "NY", "church_address_postal_code": "10001", "church_address_street_address": "1 Church St", "distance": str(k * 0.3), "comments": ""})
+        with open(os.path.join(directory, f"City_{i // 10}_page{i % 10 + 1}.json"), "w") as f:
+            json.dump(records, f)
+
+
+class Timer:
+    def __init__(self):
+        self.seconds = {}
+
+    def time(self, stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+        return result
+
+def _read(path):
+    with open(path, "r") as f:
+        return f.read()
+
+def _stage_results(timer, nfiles, nrecords):
+    return {stage: {"seconds": seconds, "files_per_s": nfiles / seconds if seconds else 0.0, "records_per_s": nrecords / seconds if seconds else 0.0} for stage, seconds in timer.seconds.items()}
+
+def bench_cpe(directory, parser, output_path):
+    timer = Timer()
+    filenames = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+    pages = []
+    for filename in filenames:
+        html = timer.time("read", _read, filename)
+        soup = timer.time("parse", make_soup, html, parser)
+        pages.append(timer.time("extract", make_cpe_spreadsheet._details_dicts, soup))
+    # the normalizers on the raw page text, once per page like _programs, parse_address without the address cache
+    configure_address_cache(maxsize=0)
+    timer.time("parse_address", lambda: [parse_address(details.get("address", "")) for details_dicts in pages for details in details_dicts])
+    configure_address_cache()
+    normalized = []
+    for details_dicts in pages:
+        phones = timer.time("phone", parse_phones, [details.get("phone", "") for details in details_dicts])
+        people = timer.time("email", emails_to_people, [details.get("email", "") for details in details_dicts])
+        normalized.extend(zip(phones, people))
+    # filling the programs is not timed, it only puts the results of the stages above together
+    programs = []
+    for details, (phone_parts, person) in zip([details for details_dicts in pages for details in details_dicts], normalized):
+        program = make_cpe_spreadsheet.Program()
+        program.fill(details, (phone_parts, person))
+        programs.append(program)
+    timer.time("output", _write, output_path, make_cpe_spreadsheet.Program.header(), [program.values() for program in programs])
+    return _stage_results(timer, len(filenames), len(programs))
+
+def bench_acpe(directory, parser, output_path):
+    timer = Timer()
+    filenames = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+    rows = []
+    for filename in filenames:
+        html = timer.time("read", _read, filename)
+        soup = timer.time("parse", make_soup, html, parser)
+        contacts = timer.time("extract", make_acpe_spreadsheet._contacts, soup, filename)
+        details = timer.time("extract", make_acpe_spreadsheet._program_details, soup)
+        rows.extend(contact.values() + details.values() for contact in contacts)
+    header = f"{models.Contact.header()}\t{models.ProgramDetails.header()}"
+    timer.time("output", _write, output_path, header, rows)
+    return _stage_results(timer, len(filenames), len(rows))
+
+def bench_updateparishdata(directory, output_path):
+    timer = Timer()
+    filenames = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+    churches, pastors, phones = [], [], []
+    for filename in filenames:
+        # the builder's own read path, ijson when it is installed
+        records = timer.time("read", lambda: list(make_updateparishdata_spreadsheet.iter_records(filename)))
+        for record in records:
+            pastors.append(record.pop("pastors_name", ""))
+            phones.append(record.pop("phone", "") or record.pop("phone_number", ""))
+        churches.extend(timer.time("extract", lambda: [make_updateparishdata_spreadsheet.parse_record(record) for record in records]))
+    # the pastor and phone parsing left out of extract above, on the raw record text
+    timer.time("pastor", lambda: [make_updateparishdata_spreadsheet.Pastor(pastor) for pastor in pastors if pastor])
+    timer.time("phone", lambda: [Phone(phone) for phone in phones if phone])
+    timer.time("output", _write, output_path, make_updateparishdata_spreadsheet.Church.header(), [church.values() for church in churches])
+    return _stage_results(timer, len(filenames), len(churches))
+
+def _write(path, header, rows):
+    with TsvWriter(path, header) as writer:
+        for row in rows:
+            writer.write(row)
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+def compare(results, baseline, threshold, min_seconds=0.05):
+    """
+    Returns the stages whose throughput dropped by more than threshold against the baseline.
+    Stages shorter than min_seconds in both runs are too noisy to compare.
+    """
+    regressions = []
+    for pipeline, stages in results["pipelines"].items():
+        for stage, numbers in stages.items():
+            old = baseline["pipelines"].get(pipeline, {}).get(stage)
+            if not old or not old["files_per_s"] or max(old["seconds"], numbers["seconds"]) < min_seconds:
+                continue
+            change = numbers["files_per_s"] / old["files_per_s"] - 1
+            status = "REGRESSION" if change < -threshold else "ok"
+            print(f"{pipeline:18} {stage:14} {old['files_per_s']:10.1f} -> {numbers['files_per_s']:10.1f} files/s ({change:+.1%}) {status}")
+            if change < -threshold:
+                regressions.append(f"{pipeline}.{stage}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the extraction pipeline on a synthetic corpus.")
+    parser.add_argument("--files", type=int, default=200, help="Number of files generated per pipeline")
+    parser.add_argument("--records-per-page", type=int, default=20, help="Records in every updateparishdata page")
+    parser.add_argument("--parser", choices=PARSERS, default="html.parser", help="HTML parser backend")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus generator")
+    parser.add_argument("--output", help="Path to write the results to as JSON")
+    parser.add_argument("--save-baseline", help="Path to save the results to as the new baseline")
+    parser.add_argument("--baseline", help="Path of a baseline to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed drop in throughput before a stage counts as a regression")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="Stages shorter than this in both runs are not compared")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = {"files": args.files, "parser": args.parser, "pipelines": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ("cpe", "acpe", "updateparishdata"):
+            os.makedirs(os.path.join(tmp, name))
+        generate_cpe(os.path.join(tmp, "cpe"), args.files, rng)
+        generate_acpe(os.path.join(tmp, "acpe"), args.files, rng)
+        generate_updateparishdata(os.path.join(tmp, "updateparishdata"), args.files, rng, args.records_per_page)
+
+        results["pipelines"]["cpe"] = bench_cpe(os.path.join(tmp, "cpe"), args.parser, os.path.join(tmp, "cpe.tsv"))
+        results["pipelines"]["acpe"] = bench_acpe(os.path.join(tmp, "acpe"), args.parser, os.path.join(tmp, "acpe.tsv"))
+        results["pipelines"]["updateparishdata"] = bench_updateparishdata(os.path.join(tmp, "updateparishdata"), os.path.join(tmp, "updateparishdata.tsv"))
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    for pipeline, stages in results["pipelines"].items():
+        for stage, numbers in stages.items():
+            print(f"{pipeline:18} {stage:14} {numbers['seconds']:8.3f}s {numbers['files_per_s']:10.1f} files/s {numbers['records_per_s']:10.1f} records/s")
+    print(f"Peak RSS: {results['peak_rss_mb']:.1f} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved: {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            exit(1)
+        print("No regressions")
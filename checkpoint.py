@@ -0,0 +1,64 @@
+"""
+Checkpoints of a spreadsheet build, so a run that crashed or was stopped can
+continue where it left off instead of starting over.
+
+Files are processed in the order of parallel.sort_by_id, so a checkpoint only
+needs the number of files done. With it goes whatever state the builder needs
+to carry on, like the size of the output written so far.
+"""
+import os
+import pickle
+import time
+
+from parallel import sort_by_id
+
+
+class Checkpoint:
+    """
+    Args:
+        path: Checkpoint file.
+        key: Describes the run, a checkpoint left by a run with another key is ignored.
+        every: Seconds between saves.
+    """
+    def __init__(self, path, key, every=30.0):
+        self.path = path
+        self.key = key
+        self.every = every
+        self.saved = time.monotonic()
+
+    def resume(self, filenames):
+        """
+        Returns the files still to do, in order, and the state of the last
+        checkpoint, or all files and None when there is nothing to resume.
+        """
+        filenames = sort_by_id(filenames)
+        if not os.path.exists(self.path):
+            return filenames, None
+        with open(self.path, "rb") as f:
+            checkpoint = pickle.load(f)
+        files_done = checkpoint["files_done"]
+        if checkpoint["key"] != self.key:
+            print(f"Ignoring checkpoint {self.path}, it was left by a run with other arguments")
+            return filenames, None
+        if files_done > len(filenames) or (files_done and filenames[files_done - 1] != checkpoint["last_filename"]):
+            print(f"Ignoring checkpoint {self.path}, the input files changed since")
+            return filenames, None
+        print(f"Resuming after {files_done} files from checkpoint {self.path}")
+        return filenames[files_done:], checkpoint["state"]
+
+    def due(self):
+        return time.monotonic() - self.saved >= self.every
+
+    def save(self, files_done, last_filename, state):
+        """
+        Records that the first files_done files, up to last_filename, are done.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"key": self.key, "files_done": files_done, "last_filename": last_filename, "state": state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self.saved = time.monotonic()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,133 @@
+"""
+SQLite store of the churches found by scrape_updateparishdata.py, so runs of
+make_updateparishdata_spreadsheet.py with --db only parse the pages that are
+new or changed since the last run.
+
+Churches are keyed by id. A record replaces the stored one only if its
+last_updated is later, like the newest dedupe policy. Every page is ingested in
+one transaction together with its signature, so a run that was stopped loses
+at most the page it was on. Spreadsheets are exported with a query over the
+store, filtered on the indexed columns if needed.
+
+Example usage:
+python3 make_updateparishdata_spreadsheet.py --input "data/updateparishdata/*.json" --output churches.tsv --db churches.sqlite
+python3 church_store.py churches.sqlite ny.tsv --state NY
+python3 church_store.py churches.sqlite dioceses.parquet --format parquet --diocese "Diocese of Albany"
+"""
+import argparse
+import sqlite3
+
+from output import FORMATS, open_writer
+
+INDEXED = ("diocese_name", "state", "zip", "email")
+
+_SQL_TYPES = {str: "TEXT", float: "REAL", int: "INTEGER", bool: "BOOLEAN"}
+_PYTHON_TYPES = {sql_type: python_type for python_type, sql_type in _SQL_TYPES.items()}
+
+
+class ChurchStore:
+    """
+    Args:
+        path: SQLite file, created if missing.
+        columns: (name, python type) of every column, with id and last_updated
+            among them. Only needed to create the store, an existing one keeps
+            the columns it was created with.
+    """
+    def __init__(self, path, columns=None):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pages (page TEXT PRIMARY KEY, signature TEXT, churches INTEGER)")
+        rows = self.connection.execute("PRAGMA table_info(churches)").fetchall()
+        if not rows:
+            if columns is None:
+                raise ValueError(f"No churches in {path}")
+            definitions = ", ".join(f"{name} {_SQL_TYPES[column_type]}" + (" PRIMARY KEY" if name == "id" else "") for name, column_type in columns)
+            with self.connection:
+                self.connection.execute(f"CREATE TABLE churches ({definitions})")
+                for name in INDEXED:
+                    self.connection.execute(f"CREATE INDEX churches_{name} ON churches ({name})")
+            rows = self.connection.execute("PRAGMA table_info(churches)").fetchall()
+        self.columns = [(name, _PYTHON_TYPES[sql_type]) for _, name, sql_type, *_ in rows]
+        if columns is not None and [name for name, _ in columns] != [name for name, _ in self.columns]:
+            raise ValueError(f"The churches in {path} have other columns, remove it to start over")
+        names = [name for name, _ in self.columns]
+        updates = ", ".join(f"{name} = excluded.{name}" for name in names if name != "id")
+        self._upsert = (
+            f"INSERT INTO churches ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})"
+            f" ON CONFLICT (id) DO UPDATE SET {updates} WHERE COALESCE(excluded.last_updated, '') > COALESCE(churches.last_updated, '')"
+        )
+
+    def pending(self, signatures):
+        """
+        Pages of the {page: signature} dict that were never ingested or changed
+        since, in the order of the dict.
+        """
+        ingested = dict(self.connection.execute("SELECT page, signature FROM pages"))
+        return [page for page, signature in signatures.items() if ingested.get(page) != signature]
+
+    def ingest(self, page, signature, rows):
+        """
+        Upserts the rows of a page, lists of values in column order, and records
+        the page as ingested.
+        """
+        with self.connection:
+            self.connection.executemany(self._upsert, rows)
+            self.connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)", (page, signature, len(rows)))
+
+    def query(self, **filters):
+        """
+        Yields the churches as lists of values in column order, in the order
+        they were first stored. Filters are column=value, for the INDEXED columns.
+        """
+        for name in filters:
+            if name not in INDEXED:
+                raise ValueError(f"Can only filter on {INDEXED}, not {name}")
+        where = " AND ".join(f"{name} = ?" for name in filters)
+        sql = f"SELECT * FROM churches{' WHERE ' + where if where else ''} ORDER BY rowid"
+        bools = [i for i, (_, column_type) in enumerate(self.columns) if column_type is bool]
+        for row in self.connection.execute(sql, list(filters.values())):
+            row = list(row)
+            for i in bools:
+                row[i] = bool(row[i])
+            yield row
+
+    def export(self, path, format="tsv", compress=False, **filters):
+        """
+        Writes the churches matching filters to path, returns the writer.
+        """
+        with open_writer(path, self.columns, format, compress) as writer:
+            for row in self.query(**filters):
+                writer.write(row)
+        return writer
+
+    def stats(self):
+        churches, emails = self.connection.execute("SELECT COUNT(*), COUNT(DISTINCT email) FROM churches").fetchone()
+        pages, records = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(churches), 0) FROM pages").fetchone()
+        return churches, emails, pages, records
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the churches of a church store.")
+    parser.add_argument("db", help="Path to the church store")
+    parser.add_argument("output", help="Path to the output file")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="tsv", help="Output format, parquet and arrow need pyarrow")
+    parser.add_argument("-z", "--gzip", action="store_true", help="Compress the output with gzip, also done for paths ending in .gz")
+    parser.add_argument("--diocese", dest="diocese_name", help="Only export the churches of this diocese")
+    parser.add_argument("--state", help="Only export the churches in this state")
+    parser.add_argument("--zip", help="Only export the churches with this zip code")
+    parser.add_argument("--email", help="Only export the churches with this email")
+    args = parser.parse_args()
+
+    filters = {name: getattr(args, name) for name in INDEXED if getattr(args, name) is not None}
+    with ChurchStore(args.db) as db:
+        writer = db.export(args.output, args.format, args.gzip, **filters)
+    print(f"{args.format.upper()} file created: {args.output} with {writer.rows} rows.")
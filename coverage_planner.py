@@ -0,0 +1,153 @@
+"""
+Coverage planner for the updateparishdata scraper.
+
+Every finished city query covers a disc around the city center, out to the
+farthest church it returned. Cities whose expected disc already lies inside a
+covered one are skipped, and queries that keep returning only churches seen
+before are stopped once the area they reached is covered.
+"""
+import math
+import statistics
+import threading
+
+_EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * _EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+def _coordinates(record):
+    try:
+        return float(record["latitude"]), float(record["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class _Query:
+    __slots__ = ("lat", "lng", "reach", "pages", "duplicate_pages", "stopped")
+
+    def __init__(self, lat, lng):
+        self.lat = lat
+        self.lng = lng
+        self.reach = 0.0
+        self.pages = 0
+        self.duplicate_pages = 0
+        self.stopped = False
+
+
+class CoveragePlanner:
+    """
+    Args:
+        radius_km: Reach expected from a new query, defaults to the median reach of finished ones.
+        stop_after: Consecutive pages of only known churches before a covered query is stopped.
+    """
+    def __init__(self, radius_km=None, stop_after=2):
+        self.radius_km = radius_km
+        self.stop_after = stop_after
+        self.discs = []
+        self.seen_ids = set()
+        self.queries = {}
+        self.lock = threading.Lock()
+        self.skipped_cities = 0
+        # pages fetched by queries that ran to the end, and by the ones that were stopped
+        self.complete_pages = []
+        self.stopped_pages = []
+        self.pages_fetched = 0
+        self.records_fetched = 0
+        self.duplicate_records = 0
+        # fetched plus seeded from disk, for estimating what skipped queries would have cost
+        self.known_pages = 0
+        self.known_records = 0
+
+    def expected_reach(self):
+        if self.radius_km is not None:
+            return self.radius_km
+        if not self.discs:
+            return None
+        return statistics.median(radius for _, _, radius in self.discs)
+
+    def _covered(self, lat, lng, radius):
+        return any(haversine_km(lat, lng, disc_lat, disc_lng) + radius <= disc_radius for disc_lat, disc_lng, disc_radius in self.discs)
+
+    def should_skip(self, city, lat, lng):
+        with self.lock:
+            reach = self.expected_reach()
+            if reach is None or not self._covered(lat, lng, reach):
+                return False
+            self.skipped_cities += 1
+            print(f"Coverage: skipping {city}, a {reach:.1f} km disc around it is already covered")
+            return True
+
+    def observe_page(self, city, lat, lng, records):
+        """
+        Records a fetched page and returns True if the query should stop.
+        """
+        with self.lock:
+            query = self.queries.setdefault(city, _Query(lat, lng))
+            query.pages += 1
+            new_records = 0
+            for record in records:
+                coordinates = _coordinates(record)
+                if coordinates is not None:
+                    query.reach = max(query.reach, haversine_km(lat, lng, *coordinates))
+                church_id = record.get("id")
+                if church_id in self.seen_ids:
+                    self.duplicate_records += 1
+                else:
+                    self.seen_ids.add(church_id)
+                    new_records += 1
+            self.pages_fetched += 1
+            self.records_fetched += len(records)
+            self.known_pages += 1
+            self.known_records += len(records)
+            query.duplicate_pages = query.duplicate_pages + 1 if records and not new_records else 0
+            if query.duplicate_pages >= self.stop_after and self._covered(lat, lng, query.reach):
+                print(f"Coverage: stopping {city} after page {query.pages}, {query.reach:.1f} km around it is already covered")
+                self.stopped_pages.append(query.pages)
+                query.stopped = True
+                return True
+            return False
+
+    def finish(self, city):
+        with self.lock:
+            query = self.queries.pop(city, None)
+            if query is None:
+                return
+            if not query.stopped:
+                self.complete_pages.append(query.pages)
+            self._add_disc(query)
+
+    def _add_disc(self, query):
+        if query.reach > 0:
+            self.discs.append((query.lat, query.lng, query.reach))
+
+    def seed(self, city, lat, lng, pages):
+        """
+        Adds a query finished by an earlier run from the records of its pages.
+        """
+        pages = list(pages)
+        for records in pages:
+            with self.lock:
+                query = self.queries.setdefault(city, _Query(lat, lng))
+                for record in records:
+                    coordinates = _coordinates(record)
+                    if coordinates is not None:
+                        query.reach = max(query.reach, haversine_km(lat, lng, *coordinates))
+                    self.seen_ids.add(record.get("id"))
+                self.known_pages += 1
+                self.known_records += len(records)
+        with self.lock:
+            query = self.queries.pop(city, None)
+            if query is not None:
+                self.complete_pages.append(len(pages))
+                self._add_disc(query)
+
+    def report(self):
+        pages_per_query = statistics.mean(self.complete_pages) if self.complete_pages else 0.0
+        records_per_page = self.known_records / max(1, self.known_pages)
+        avoided_requests = self.skipped_cities * pages_per_query + sum(max(0.0, pages_per_query - pages) for pages in self.stopped_pages)
+        print(f"Coverage: skipped {self.skipped_cities} cities and stopped {len(self.stopped_pages)} early")
+        print(f"Coverage: avoided about {round(avoided_requests)} requests and {round(avoided_requests * records_per_page)} duplicate records, at {pages_per_query:.1f} pages per complete query")
+        print(f"Coverage: fetched {self.pages_fetched} pages with {self.records_fetched} records, {self.duplicate_records} of them duplicates")
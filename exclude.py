@@ -0,0 +1,84 @@
+"""
+Loads the emails to leave out of the CPE spreadsheet from one or more TSV files
+with an "email" column.
+
+The emails of every file are compiled once into a sorted index saved next to
+it, which is reused for as long as the file keeps its size and mtime. Emails
+are compared lowercased.
+"""
+import os
+import pickle
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+def _parse_exclude_file(path):
+    emails = set()
+    idx = None
+    with open(path, "r") as f:
+        for i, line in enumerate(f):
+            if idx is None:
+                headers = line.strip().split("\t")
+                for j, header in enumerate(headers):
+                    if header.lower() == "email":
+                        idx = j
+                        break
+            if idx is not None and i > 0:
+                items = line.strip().split("\t")
+                if idx < len(items) and items[idx]:
+                    emails.add(normalize_email(items[idx]))
+    return emails
+
+def _index_path(path):
+    return f"{path}.idx"
+
+def _read_index(index_path):
+    """
+    (key, emails) of an index, ValueError if it does not hold them.
+    """
+    with open(index_path, "rb") as f:
+        index = pickle.load(f)
+    if not isinstance(index, dict) or not isinstance(index.get("key"), tuple) or not isinstance(index.get("emails"), list):
+        raise ValueError("not an exclude index")
+    if not all(isinstance(email, str) for email in index["emails"]):
+        raise ValueError("not an exclude index")
+    return index["key"], index["emails"]
+
+def load_exclude_file(path):
+    """
+    Emails of one exclude file, from its index when it is still up to date.
+    The file is just parsed when the index can not be read or written, like
+    next to an exclude file in a read-only directory, and the index rebuilt when
+    it is damaged.
+    """
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    index_path = _index_path(path)
+    if os.path.exists(index_path):
+        try:
+            index_key, emails = _read_index(index_path)
+            if index_key == key:
+                return frozenset(emails)
+        # pickle.load raises about any exception on a damaged file
+        except Exception as e:
+            print(f"Ignoring the index of {path}: {e!r}")
+    emails = _parse_exclude_file(path)
+    if not emails:
+        raise ValueError(f"No emails found in the exclude file: {path}")
+    tmp_path = f"{index_path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"key": key, "emails": sorted(emails)}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        print(f"Could not write the index of {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return frozenset(emails)
+
+def load_exclude_emails(paths):
+    emails = set()
+    for path in paths:
+        emails |= load_exclude_file(path)
+    return frozenset(emails)
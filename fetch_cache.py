@@ -0,0 +1,74 @@
+"""
+Validators of every fetched URL, so pages already on disk are refreshed with
+conditional requests instead of being downloaded again in full.
+
+For every URL the ETag, Last-Modified and a hash of the body are kept in a
+SQLite file. A 304 Not Modified, or a 200 with the same body, counts as
+unchanged and the page on disk is left alone, so its size and mtime stay the
+same and the manifest of the builders reuses its parsed rows.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class FetchCache:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self.unchanged = 0
+        self.changed = 0
+
+    def _db(self):
+        # sqlite connections can not be shared with forked worker processes
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS validators (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, sha1 TEXT, fetched_at REAL, checked_at REAL)")
+            self._pid = os.getpid()
+        return self._connection
+
+    def headers(self, url):
+        """
+        Conditional request headers for url, empty if it was never fetched.
+        """
+        with self.lock:
+            row = self._db().execute("SELECT etag, last_modified FROM validators WHERE url = ?", (url,)).fetchone()
+        headers = {}
+        if row is not None:
+            etag, last_modified = row
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def not_modified(self, url):
+        """
+        Records a 304 response for url.
+        """
+        with self.lock, self._db() as db:
+            db.execute("UPDATE validators SET checked_at = ? WHERE url = ?", (time.time(), url))
+            self.unchanged += 1
+
+    def record(self, url, response_headers, body):
+        """
+        Records a full response and returns whether the body changed since the
+        last one, or is new.
+        """
+        digest = hashlib.sha1(body).hexdigest()
+        now = time.time()
+        with self.lock, self._db() as db:
+            row = db.execute("SELECT sha1, fetched_at FROM validators WHERE url = ?", (url,)).fetchone()
+            changed = row is None or row[0] != digest
+            fetched_at = now if changed else row[1]
+            db.execute("INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?, ?)", (url, response_headers.get("ETag"), response_headers.get("Last-Modified"), digest, fetched_at, now))
+            if changed:
+                self.changed += 1
+            else:
+                self.unchanged += 1
+        return changed
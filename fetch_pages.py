@@ -0,0 +1,201 @@
+"""
+Downloads the CPE or ACPE page of every identifier in a text file.
+
+Example usage:
+python3 fetch_pages.py cpe ids.txt
+python3 fetch_pages.py acpe ids.txt --concurrency 8 --rate 2
+python3 fetch_pages.py cpe ids.txt --store snapshots
+python3 fetch_pages.py cpe ids.txt --fetch-cache cpe_data/fetch_cache.sqlite
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from fetch_cache import FetchCache
+import instrument
+from snapshot_store import SnapshotStore
+
+_SOURCES = {
+    "cpe": ("https://chaplaincyandspiritualcare.com/{}", "cpe_data"),
+    "acpe": ("https://profile.acpe.edu/centerdetails?id={}", "data"),
+}
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average, with bursts of up to burst requests.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Fetcher:
+    """
+    Writes every page to output_dir, or to the snapshot store under source when
+    one is given. With a fetch cache, pages that were fetched before are
+    requested conditionally and only written again when they changed.
+    """
+    def __init__(self, session, concurrency, rate, burst, retries, backoff, output_dir=None, store=None, source=None, fetch_cache=None):
+        self.session = session
+        self.output_dir = output_dir
+        self.store = store
+        self.source = source
+        self.fetch_cache = fetch_cache
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.buckets = {}
+        self.downloaded = 0
+        self.unchanged = 0
+        self.failed = 0
+
+    def _bucket(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        return self.buckets[host]
+
+    def _have(self, identifier):
+        if self.store is not None:
+            return self.store.has(self.source, identifier)
+        return os.path.exists(os.path.join(self.output_dir, f"{identifier}.html"))
+
+    def _save(self, identifier, body):
+        if self.store is not None:
+            self.store.put(self.source, identifier, body)
+            self.store.flush()
+        else:
+            _write_atomic(os.path.join(self.output_dir, f"{identifier}.html"), body)
+
+    async def fetch(self, url, identifier):
+        async with self.semaphore:
+            have = self.fetch_cache is not None and self._have(identifier)
+            headers = self.fetch_cache.headers(url) if have else {}
+            for attempt in range(self.retries):
+                await self._bucket(url).acquire()
+                try:
+                    with instrument.stage("fetch.request", url):
+                        async with self.session.get(url, headers=headers) as response:
+                            if response.status == 304:
+                                self.fetch_cache.not_modified(url)
+                                self.unchanged += 1
+                                instrument.count("fetch.unchanged")
+                                print(f"Unchanged: {url}")
+                                return True
+                            response.raise_for_status()
+                            body = await response.read()
+                            response_headers = response.headers
+                    if self.fetch_cache is not None and not self.fetch_cache.record(url, response_headers, body) and have:
+                        self.unchanged += 1
+                        instrument.count("fetch.unchanged")
+                        print(f"Unchanged: {url}")
+                        return True
+                    self._save(identifier, body)
+                    self.downloaded += 1
+                    instrument.count("fetch.pages")
+                    print(f"Downloaded: {url}")
+                    return True
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    print(f"Error downloading: {url} (Attempt: {attempt + 1}) {e}")
+                    if attempt + 1 < self.retries:
+                        instrument.count("fetch.retries")
+                        delay = self.backoff * 2 ** attempt
+                        await asyncio.sleep(delay + random.uniform(0, delay))
+            self.failed += 1
+            instrument.count("fetch.failures")
+            print(f"Failed to download after {self.retries} retries: {url}")
+            return False
+
+def _write_atomic(path, body):
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+def read_identifiers(filename):
+    with open(filename, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def pending_identifiers(identifiers, output_dir=None, store=None, source=None):
+    """
+    Identifiers whose page is not on disk, or in the snapshot store, yet.
+    """
+    if store is not None:
+        return [identifier for identifier in identifiers if not store.has(source, identifier)]
+    done = set()
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".html") and entry.stat().st_size > 0:
+                done.add(entry.name[:-len(".html")])
+    return [identifier for identifier in identifiers if identifier not in done]
+
+async def fetch_all(identifiers, url_template, output_dir=None, concurrency=4, rate=1.0, burst=1, retries=3, backoff=1.0, timeout=60, store=None, source=None, fetch_cache=None):
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        fetcher = Fetcher(session, concurrency, rate, burst, retries, backoff, output_dir, store, source, fetch_cache)
+        tasks = [fetcher.fetch(url_template.format(identifier), identifier) for identifier in identifiers]
+        await asyncio.gather(*tasks)
+    return fetcher
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download CPE or ACPE pages for a list of identifiers.")
+    parser.add_argument("source", choices=sorted(_SOURCES), help="Which site to download from")
+    parser.add_argument("identifiers", help="Path to a text file with one identifier per line")
+    parser.add_argument("--output", help="Output directory, defaults to cpe_data or data")
+    parser.add_argument("--store", help="Path to a snapshot store to write the pages to instead of the output directory")
+    parser.add_argument("--fetch-cache", help="Path to a SQLite file of page validators, pages fetched before are then revalidated instead of skipped")
+    parser.add_argument("--url", help="URL template with {} for the identifier, overrides the source URL")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of requests in flight")
+    parser.add_argument("--rate", type=float, default=1.0, help="Requests per second allowed per host")
+    parser.add_argument("--burst", type=int, default=1, help="Requests per host allowed in a burst")
+    parser.add_argument("--retries", type=int, default=3, help="Attempts per page")
+    parser.add_argument("--backoff", type=float, default=1.0, help="Seconds to wait after the first failed attempt, doubled on every retry")
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.enable_from_args(args)
+
+    url_template, output_dir = _SOURCES[args.source]
+    url_template = args.url or url_template
+    output_dir = args.output or output_dir
+    store = None
+    if args.store:
+        store = SnapshotStore(args.store, create=True)
+    elif not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+        print(f"Created '{output_dir}' directory for downloaded files.")
+
+    identifiers = read_identifiers(args.identifiers)
+    fetch_cache = None
+    if args.fetch_cache:
+        fetch_cache = FetchCache(args.fetch_cache)
+        todo = identifiers
+    else:
+        todo = pending_identifiers(identifiers, output_dir, store, args.source)
+        print(f"Skipping {len(identifiers) - len(todo)} identifiers already fetched, fetching {len(todo)}")
+    fetcher = asyncio.run(fetch_all(todo, url_template, output_dir, args.concurrency, args.rate, args.burst, args.retries, args.backoff, store=store, source=args.source, fetch_cache=fetch_cache))
+    if store is not None:
+        store.close()
+    print(f"Download process complete. {fetcher.downloaded} downloaded, {fetcher.unchanged} unchanged, {fetcher.failed} failed.")
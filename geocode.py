@@ -0,0 +1,86 @@
+"""
+Persistent cache of city geocodes, so reruns of the scrapers do not ask
+Nominatim for the same cities again.
+
+The cache is a JSON file keyed by the normalized city string. Entries older
+than the TTL are geocoded again.
+"""
+import json
+import os
+import re
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+# Nominatim's usage policy allows one request per second
+_GEOCODE_INTERVAL = 1.0
+
+
+def normalize_city(city: str) -> str:
+    city = " ".join(city.lower().split())
+    return re.sub(r"\s*,\s*", ", ", city).strip(", ")
+
+
+class GeocodeCache:
+    def __init__(self, path: Optional[str] = None, ttl_days: float = 180, user_agent: str = "my_app"):
+        self.path = path
+        self.ttl_seconds = ttl_days * 24 * 3600
+        self.user_agent = user_agent
+        self.entries = {}
+        self.calls = 0
+        self._geolocator = None
+        self._last_call = 0.0
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+
+    def lookup(self, city: str) -> Optional[Tuple[float, float]]:
+        """
+        Cached coordinates of city, or None if it is not cached or expired.
+        Cities the geocoder could not find are cached as (0.0, 0.0).
+        """
+        entry = self.entries.get(normalize_city(city))
+        if entry is None or time.time() - entry["time"] > self.ttl_seconds:
+            return None
+        return entry["lat"], entry["lng"]
+
+    def geocode(self, city: str) -> Tuple[float, float]:
+        cached = self.lookup(city)
+        if cached is not None:
+            return cached
+        if self._geolocator is None:
+            from geopy.geocoders import Nominatim
+            self._geolocator = Nominatim(user_agent=self.user_agent)
+        wait = self._last_call + _GEOCODE_INTERVAL - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_call = time.monotonic()
+        self.calls += 1
+        location = self._geolocator.geocode(city)
+        if location is None:
+            print(f"Failed to get location for {city}")
+            lat, lng = 0.0, 0.0
+        else:
+            lat, lng = location.latitude, location.longitude
+        self.entries[normalize_city(city)] = {"lat": lat, "lng": lng, "time": time.time()}
+        return lat, lng
+
+    def resolve_all(self, cities: Iterable[str]) -> Dict[str, Tuple[float, float]]:
+        """
+        Coordinates of every city, geocoding only the ones missing from the cache.
+        The cache is saved after every new geocode so an interrupted run keeps them.
+        """
+        coordinates = {}
+        for city in cities:
+            calls = self.calls
+            coordinates[city] = self.geocode(city)
+            if self.calls != calls:
+                self.save()
+        return coordinates
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,63 @@
+"""
+Enumerates the input files of the spreadsheet builders, optionally only one
+shard of them.
+
+Files are streamed from os.scandir of the pattern's directory instead of
+expanding the whole glob into a list first. Shards split the inputs by a
+stable hash of the file ID, so the same file always lands in the same shard,
+on any machine. Part outputs are combined with merge_parts.py.
+"""
+import fnmatch
+import glob
+import os
+import zlib
+
+from parallel import file_id
+
+
+def shard(text):
+    """
+    argparse type for --shard, "i/N" for shard i of N counting from 0.
+    """
+    index, count = (int(part) for part in text.split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Shard index must be between 0 and {count - 1}: {text}")
+    return index, count
+
+def in_shard(file_path, shard=None):
+    if shard is None:
+        return True
+    index, count = shard
+    return zlib.crc32(file_id(file_path).encode("utf-8")) % count == index
+
+def _scan(directory, name_pattern):
+    # glob leaves out hidden files unless the pattern asks for them
+    hidden = name_pattern.startswith(".")
+    with os.scandir(directory or ".") as entries:
+        for entry in entries:
+            if (hidden or not entry.name.startswith(".")) and fnmatch.fnmatchcase(entry.name, name_pattern) and entry.is_file():
+                yield os.path.join(directory, entry.name)
+
+def iter_filenames(file_pattern, shard=None):
+    """
+    Yields the files matching a glob pattern, a single file or all files of a
+    directory, in no particular order.
+    """
+    if os.path.isfile(file_pattern):
+        filenames = iter([file_pattern])
+    elif os.path.isdir(file_pattern):
+        filenames = _scan(file_pattern, "*")
+    else:
+        directory, name_pattern = os.path.split(file_pattern)
+        if glob.has_magic(directory):
+            filenames = (filename for filename in glob.iglob(file_pattern) if os.path.isfile(filename))
+        elif os.path.isdir(directory or "."):
+            filenames = _scan(directory, name_pattern)
+        else:
+            filenames = iter([])
+    for filename in filenames:
+        if in_shard(filename, shard):
+            yield filename
+
+def get_filenames(file_pattern, shard=None):
+    return list(iter_filenames(file_pattern, shard))
@@ -0,0 +1,239 @@
+"""
+Opt-in instrumentation of the builders and scrapers.
+
+Nothing is recorded unless enable() was called, or the process was started
+with SCRAPE_INSTRUMENT set, which enable() does so worker processes record
+too. Stages keep their call count, total time and slowest inputs, counters add
+up events like leftover keys, failed parses or retries. At exit the main
+process writes a JSON report, and optionally a cProfile dump and a file of
+sampled stacks in the collapsed format of flamegraph.pl and speedscope.
+"""
+import atexit
+import collections
+import cProfile
+import functools
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_ENV = "SCRAPE_INSTRUMENT"
+_TOP = 10
+_SAMPLE_INTERVAL = 0.005
+
+
+class Metrics:
+    def __init__(self, top=_TOP):
+        self.top = top
+        # name: [calls, seconds]
+        self.stages = {}
+        self.counters = collections.Counter()
+        # name: min-heap of the top (seconds, input)
+        self.slowest = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds, label=None):
+        with self.lock:
+            stage = self.stages.setdefault(name, [0, 0.0])
+            stage[0] += 1
+            stage[1] += seconds
+            if label is not None:
+                self._push_slowest(name, (seconds, str(label)))
+
+    def _push_slowest(self, name, item):
+        heap = self.slowest.setdefault(name, [])
+        if len(heap) < self.top:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "stages": {name: list(stage) for name, stage in self.stages.items()},
+                "counters": dict(self.counters),
+                "slowest": {name: list(heap) for name, heap in self.slowest.items()},
+            }
+
+    def merge(self, snapshot):
+        with self.lock:
+            for name, (calls, seconds) in snapshot["stages"].items():
+                stage = self.stages.setdefault(name, [0, 0.0])
+                stage[0] += calls
+                stage[1] += seconds
+            self.counters.update(snapshot["counters"])
+            for name, items in snapshot["slowest"].items():
+                for seconds, label in items:
+                    self._push_slowest(name, (seconds, label))
+
+    def report(self):
+        stages = {}
+        with self.lock:
+            for name, (calls, seconds) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+                stages[name] = {
+                    "calls": calls,
+                    "seconds": seconds,
+                    "mean_ms": 1000 * seconds / calls if calls else 0.0,
+                    "slowest": [{"seconds": seconds, "input": label} for seconds, label in sorted(self.slowest.get(name, []), reverse=True)],
+                }
+            return {"stages": stages, "counters": dict(sorted(self.counters.items()))}
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stacks of all other threads every interval seconds and counts
+    them in collapsed form, outermost frame first.
+    """
+    def __init__(self, interval=_SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                names = []
+                while frame is not None:
+                    names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+
+_metrics = Metrics() if os.environ.get(_ENV) else None
+_profiler = None
+_sampler = None
+_start = time.perf_counter()
+
+def enabled():
+    return _metrics is not None
+
+def enable(report_path=None, profile_path=None, stacks_path=None, top=_TOP):
+    """
+    Starts recording in this process and the worker processes it starts. The
+    report, profile and stacks are written to the given paths at exit.
+    """
+    global _metrics, _profiler, _sampler, _start
+    _metrics = Metrics(top)
+    _start = time.perf_counter()
+    os.environ[_ENV] = "1"
+    if profile_path:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    if stacks_path:
+        _sampler = StackSampler()
+        _sampler.start()
+    atexit.register(_finish, report_path, profile_path, stacks_path)
+
+def _reset_in_child():
+    # forked workers start from empty metrics, their own get merged back through worker_info
+    global _metrics, _profiler, _sampler
+    if _metrics is not None:
+        _metrics = Metrics(_metrics.top)
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler = None
+    _sampler = None
+
+os.register_at_fork(after_in_child=_reset_in_child)
+
+def _finish(report_path, profile_path, stacks_path):
+    if _sampler is not None:
+        _sampler.stop()
+        _sampler.write(stacks_path)
+        print(f"Stacks written: {stacks_path}")
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(profile_path)
+        print(f"Profile written: {profile_path}")
+    if report_path:
+        report = {"argv": sys.argv, "wall_seconds": time.perf_counter() - _start, **_metrics.report()}
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Metrics written: {report_path}")
+
+@contextmanager
+def stage(name, label=None):
+    if _metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _metrics.record(name, time.perf_counter() - start, label)
+
+def timed(name, label=None):
+    """
+    Decorator recording every call as the stage name. label is called with the
+    same arguments before the call and names the input in the slowest list.
+    Calls that raise are also counted as {name}.errors.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _metrics is None:
+                return func(*args, **kwargs)
+            input_label = label(*args, **kwargs) if label is not None else None
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                _metrics.count(f"{name}.errors")
+                raise
+            finally:
+                _metrics.record(name, time.perf_counter() - start, input_label)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    if _metrics is not None:
+        _metrics.count(name, n)
+
+def worker_info(info_func=None):
+    """
+    info_func for parallel.map_files that adds this process's metrics to the
+    info of info_func.
+    """
+    info = dict(info_func()) if info_func is not None else {}
+    if _metrics is not None:
+        info["metrics"] = _metrics.snapshot()
+    return info
+
+def absorb(stats):
+    """
+    Merges the metrics the worker processes reported into map_files stats.
+    """
+    if _metrics is None:
+        return
+    for pid, (_, _, info) in stats.items():
+        # in-process runs recorded straight into _metrics
+        if pid != os.getpid() and info and "metrics" in info:
+            _metrics.merge(info["metrics"])
+
+def add_arguments(parser):
+    parser.add_argument("--metrics", help="Path to write a JSON report of stage timings, counters and the slowest inputs to")
+    parser.add_argument("--profile", help="Path to write a cProfile dump of the main process to, read it with pstats")
+    parser.add_argument("--flamegraph", help="Path to write sampled stacks of the main process to, in the collapsed format of flamegraph.pl")
+
+def enable_from_args(args):
+    if args.metrics or args.profile or args.flamegraph:
+        enable(args.metrics, args.profile, args.flamegraph)
@@ -1,49 +1,80 @@
 """
 Example usage:
 python3 make_acpe_spreadsheet.py "data/*.html" "./cpe.tsv"
+python3 make_acpe_spreadsheet.py "data/*.html" "./cpe.tsv" --parser selectolax
+python3 make_acpe_spreadsheet.py "*" "./cpe.tsv" --store snapshots
+python3 make_acpe_spreadsheet.py "data/*.html" "./cpe.part0.tsv" --shard 0/4
 """
 
 
 import argparse
 import os
 import re
-import glob
-import argparse
-from dataclasses import dataclass
+import time
+from functools import partial
 import warnings
 
-from bs4 import BeautifulSoup
-from tqdm import tqdm
+from bs4 import SoupStrainer
+
 import validators
 
+import instrument
+from inputs import get_filenames, in_shard, shard
 from models import Contact, ProgramDetails
+from manifest import Manifest, code_version
+import models
+from output import FORMATS, open_writer
+from parallel import map_files, print_throughput
+import parsers
+from parsers import PARSERS, make_soup
+from snapshot_store import SnapshotStore, read_snapshot, timestamp
 
 
-def get_filenames(file_pattern):
-    filenames = []
-    if os.path.isfile(file_pattern):
-        filenames.append(file_pattern)
-    else:
-        filenames.extend(glob.glob(file_pattern))
-    return filenames
-
 def _contacts(soup, file_path):
-    contacts = []
     table = soup.find("table")
     if not table:
         print(f"No contacts table found in the HTML file {file_path}")
-        return contacts
+        return []
     rows = table.find_all("tr")
     if not rows:
         raise ValueError("No rows found in the table")
     header, *rest = rows
-    for row in rest:
-        items = row.find_all("td")
-        contacts.append(Contact([item.text.strip() for item in items]))
-    return contacts
+    return Contact.from_rows([[item.text.strip() for item in row.find_all("td")] for row in rest])
+
+class _CenterStrainer(SoupStrainer):
+    """
+    Only builds the tables, the div.card-heading blocks and the spans holding
+    the program details list, which is all that _contacts and _program_details read.
+    """
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        if name in ("table", "span"):
+            return True
+        if name != "div" or not attrs:
+            return False
+        classes = attrs.get("class", "")
+        if isinstance(classes, str):
+            classes = classes.split()
+        return "card-heading" in classes
+
+    # bs4 < 4.13 calls search_tag instead of allow_tag_creation
+    def search_tag(self, markup_name=None, markup_attrs=None):
+        return self.allow_tag_creation(None, markup_name, markup_attrs)
+
+def _find_program_details_div(soup):
+    return soup.find("div", class_="card-heading", text=re.compile(r"^Program Details"))
+
+def _restricted_soup(html_content, file_path, parser):
+    if parser != "selectolax":
+        soup = make_soup(html_content, parser, parse_only=_CenterStrainer())
+        if soup.find("table") and _find_program_details_div(soup):
+            return soup
+        instrument.count("acpe.full_parse_fallbacks")
+        warnings.warn(f"Restricted parse missed the contacts table or program details in {file_path}, doing a full parse")
+    return make_soup(html_content, parser)
 
+@instrument.timed("acpe.program_details")
 def _program_details(soup):
-    program_details_div = soup.find("div", class_="card-heading", text=re.compile(r"^Program Details"))
+    program_details_div = _find_program_details_div(soup)
     if not program_details_div:
         raise ValueError("No program details found in the HTML file")
     span = program_details_div.find_next("span")
@@ -78,55 +109,88 @@ def _program_details(soup):
     ret = ProgramDetails()
     leftover = ret.fill(details_dict)
     if leftover:
+        instrument.count("acpe.leftover_keys", len(leftover))
         print(f"Some unused keys in {leftover.keys()}")
     return ret
 
-def format_one_file(file_path):
-    out = []
+def _read_html(file_path, store=None, as_of=None):
+    if store is not None:
+        return read_snapshot(store, "acpe", file_path, as_of).decode("utf-8")
     if not file_path.endswith(".html"):
         raise ValueError("File must be an HTML file")
-    id = os.path.splitext(os.path.basename(file_path))[0]
     with open(file_path, "r") as html_content:
-        warnings.filterwarnings("ignore", category=DeprecationWarning)
-        soup = BeautifulSoup(html_content, "html.parser")
-        contacts = _contacts(soup, file_path)
-        details = _program_details(soup)
-        # if the details has an email add an extra contact
-        if details.other_email:
-            contacts.append(Contact(["", details.other_email]))
-            details.other_email = ""
-        # dedupe based on email
-        emails = set()
-        out_contacts = []
-        for contact in contacts:
-            if contact.email not in emails:
-                emails.add(contact.email)
-                out_contacts.append(contact)
-        for contact in out_contacts:
-            out.append(f"{id}\t{contact}\t{details}")
+        return html_content.read()
+
+@instrument.timed("acpe.format_one_file", label=lambda file_path, *args, **kwargs: file_path)
+def format_one_file(file_path, parser="html.parser", restrict=False, store=None, as_of=None):
+    """
+    With a store, file_path is the identifier of a page in the snapshot store.
+    """
+    out = []
+    id = os.path.splitext(os.path.basename(file_path))[0]
+    html_content = _read_html(file_path, store, as_of)
+    if restrict:
+        soup = _restricted_soup(html_content, file_path, parser)
+    else:
+        soup = make_soup(html_content, parser)
+    contacts = _contacts(soup, file_path)
+    details = _program_details(soup)
+    # if the details has an email add an extra contact
+    if details.other_email:
+        contacts.append(Contact(["", details.other_email]))
+        details.other_email = ""
+    # dedupe based on email
+    emails = set()
+    out_contacts = []
+    for contact in contacts:
+        if contact.email not in emails:
+            emails.add(contact.email)
+            out_contacts.append(contact)
+    for contact in out_contacts:
+        out.append([id, *contact.values(), *details.values()])
+    instrument.count("acpe.records", len(out))
     return out
         
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process HTML files in a directory.")
-    parser.add_argument("input", help="Path to the input directory")
+    parser.add_argument("input", help="Glob of the input files, or of the page identifiers with --store")
     parser.add_argument("output", help="Path to the output file")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of processes to parse files with")
+    parser.add_argument("-p", "--parser", choices=PARSERS, default="html.parser", help="HTML parser backend")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="tsv", help="Output format, parquet and arrow need pyarrow")
+    parser.add_argument("-z", "--gzip", action="store_true", help="Compress the output with gzip, also done for paths ending in .gz")
+    parser.add_argument("-m", "--manifest", help="Path to a manifest caching parsed rows between runs")
+    parser.add_argument("-r", "--restrict", action="store_true", help="Only parse the contacts table and program details")
+    parser.add_argument("--store", help="Path to a snapshot store to read the pages from instead of files")
+    parser.add_argument("--as-of", type=timestamp, help="With --store, read the pages as they were at this ISO date and time")
+    parser.add_argument("--shard", type=shard, help="Only build shard i/N of the input files, combine the parts with merge_parts.py")
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    instrument.enable_from_args(args)
 
     if not args.input or not args.output:
         raise ValueError("Input and output paths must be provided")
 
-    filenames = get_filenames(args.input)
+    if args.store:
+        if args.manifest:
+            raise ValueError("The manifest caches files on disk and can not be used with --store")
+        filenames = [filename for filename in SnapshotStore(args.store).identifiers("acpe", args.input, args.as_of) if in_shard(filename, args.shard)]
+    else:
+        filenames = get_filenames(args.input, args.shard)
     print(f"Processing {len(filenames)} files...")
-    out = []
-    for filename in tqdm(filenames):
-        new_rows = format_one_file(filename)
-        for row in new_rows:
-            out.append(row)
-    
-    header = f"ID\t{Contact.header()}\t{ProgramDetails.header()}"
-
-    with open(args.output, "w") as f:
-        f.write(header + "\n")
-        for row in out:
-            f.write(row + "\n")
-    print(f"TSV file created: {args.output} with {len(out)} rows.")
+    manifest = None
+    if args.manifest:
+        manifest = Manifest(args.manifest, code_version(__file__, models.__file__, parsers.__file__))
+    stats = {}
+    start = time.perf_counter()
+    with open_writer(args.output, [("ID", str)] + Contact.columns() + ProgramDetails.columns(), args.format, args.gzip) as writer:
+        for id, new_rows in map_files(partial(format_one_file, parser=args.parser, restrict=args.restrict, store=args.store, as_of=args.as_of), filenames, args.workers, stats, manifest, instrument.worker_info):
+            for row in new_rows:
+                writer.write(row)
+    print(f"{args.format.upper()} file created: {args.output} with {writer.rows} rows.")
+    if manifest is not None:
+        if args.shard is None:
+            manifest.prune(filenames)
+        manifest.save()
+    print_throughput(stats, time.perf_counter() - start)
+    instrument.absorb(stats)
@@ -1,23 +1,48 @@
 """
 Example usage:
 python3 make_cpe_spreadsheet.py "cpe_data/*.html" "cpe.tsv"
+python3 make_cpe_spreadsheet.py "cpe_data/*.html" "cpe.tsv" --workers 8
+python3 make_cpe_spreadsheet.py "cpe_data/*.html" "cpe.tsv" --checkpoint cpe.checkpoint
+python3 make_cpe_spreadsheet.py "*" "cpe.tsv" --store snapshots
+python3 make_cpe_spreadsheet.py "cpe_data/*.html" "cpe.part0.tsv" --shard 0/4
 """
 import argparse
-import os
-import re
-import glob
-import argparse
+import time
 from dataclasses import dataclass
-import warnings
+from functools import partial
 
-from bs4 import BeautifulSoup
-from tqdm import tqdm
-import validators
+from models import Record, Contact, Phone, parse_address, email_to_person, address_cache_info, configure_address_cache, emails_to_people, parse_phones
+from checkpoint import Checkpoint
+import instrument
+from inputs import get_filenames, in_shard, shard
+from exclude import load_exclude_emails, normalize_email
+from manifest import Manifest, code_version
+import models
+from output import FORMATS, Quarantine, open_writer, resumable
+from parallel import map_files, print_throughput, sort_by_id, sum_infos
+import parsers
+from parsers import PARSERS, make_soup
+from snapshot_store import SnapshotStore, read_snapshot, timestamp
 
-from models import Contact, ProgramDetails, Phone, parse_address, email_to_person
+@dataclass(slots=True)
+class Program(Record):
+    COLUMNS = (
+        ("name", "Name"),
+        ("street", "Street"),
+        ("city", "City"),
+        ("state", "State/Province Code"),
+        ("zip", "Zip/Postal Code"),
+        ("address", "Address"),
+        ("phone", "Phone Number"),
+        ("phone_ext", "Phone Extension"),
+        ("website", "Website"),
+        ("email", "Email"),
+        ("first", "Guessed First"),
+        ("middle", "Guessed Middle"),
+        ("last", "Guessed Last"),
+        ("units_offered", "Units Offered"),
+    )
 
-@dataclass
-class Program:
     name: str
     address: str
     street: str
@@ -36,7 +61,11 @@ class Program:
     def __init__(self):
         pass
 
-    def fill(self, details_dict):
+    def fill(self, details_dict, normalized=None):
+        """
+        normalized is the (phone_parts, person) of the details, when they were
+        normalized in a batch with parse_phones and emails_to_people.
+        """
         self.name = details_dict.pop("name", "")
         self.address = details_dict.pop("address", "")
         
@@ -55,13 +84,13 @@ class Program:
             self.street = self.city = self.state = self.zip = ""
         
         phone_text = details_dict.pop("phone", "")
-        phone = Phone(phone_text)
-        self.phone = phone.number
-        self.phone_ext = phone.extension
         self.website = details_dict.pop("website", "")
         self.email = details_dict.pop("email", "")
+        if normalized is None:
+            phone = Phone(phone_text)
+            normalized = (phone.number, phone.extension), email_to_person(self.email)
+        (self.phone, self.phone_ext), person = normalized
         if self.email:
-            person = email_to_person(self.email)
             if person is not None:
                 self.first, self.middle, self.last = person.first, person.middle, person.last
             else:
@@ -71,24 +100,6 @@ class Program:
         self.units_offered = details_dict.pop("units offered", "")
         
         return details_dict
-    
-    def __str__(self):
-        return f"{self.name}\t{self.street}\t{self.city}\t{self.state}\t{self.zip}\t{self.address}\t{self.phone}\t{self.phone_ext}\t{self.website}\t{self.email}\t{self.first}\t{self.middle}\t{self.last}\t{self.units_offered}"
-
-    @classmethod
-    def header(cls):
-        return "Name\tStreet\tCity\tState/Province Code\tZip/Postal Code\tAddress\tPhone Number\tPhone Extension\tWebsite\tEmail\tGuessed First\tGuessed Middle\tGuessed Last\tUnits Offered"
-
-def get_filenames(file_pattern):
-    filenames = []
-    if os.path.isfile(file_pattern):
-        filenames.append(file_pattern)
-    else:
-        filenames.extend(glob.glob(file_pattern))
-    for filename in filenames:
-        if not os.path.exists(filename):
-            raise FileNotFoundError(f"File {filename} does not exist")
-    return filenames
 
 def _contacts(soup, file_path):
     contacts = []
@@ -119,15 +130,13 @@ def _unify_key(key):
         return "email"
     return key
 
-def _programs(soup, file_path):
-    ret = []
-    details_dict = {}
+def _details_dicts(soup):
+    """
+    Raw {key: text} details of every program of a page.
+    """
     programs = soup.find_all("h3", class_="wp-block-heading")
-    if not programs:
-        return ret
-        # raise ValueError(f"No programs found in the HTML file: {file_path}")
+    details_dicts = []
     for program in programs:
-        parsed_program = Program()
         details_dict = {}
         details_dict["name"] = program.text
         next_element = program.find_next_sibling()
@@ -143,73 +152,146 @@ def _programs(soup, file_path):
             details_dict[_unify_key(key)] = value
             # move to next
             next_element = next_element.find_next_sibling()
-        leftover = parsed_program.fill(details_dict)
+        details_dicts.append(details_dict)
+    return details_dicts
+
+@instrument.timed("cpe.programs", label=lambda soup, file_path, rejected=None: file_path)
+def _programs(soup, file_path, rejected=None):
+    """
+    Programs of a page. Programs that fail to parse raise, or are added to
+    rejected as (reason, details) when a list is given.
+    """
+    ret = []
+    details_dicts = _details_dicts(soup)
+    if not details_dicts:
+        return ret
+        # raise ValueError(f"No programs found in the HTML file: {file_path}")
+    phones = parse_phones([details_dict.get("phone", "") for details_dict in details_dicts])
+    people = emails_to_people([details_dict.get("email", "") for details_dict in details_dicts])
+    for details_dict, phone_parts, person in zip(details_dicts, phones, people):
+        parsed_program = Program()
+        try:
+            details = dict(details_dict) if rejected is not None else None
+            leftover = parsed_program.fill(details_dict, (phone_parts, person))
+        except ValueError as e:
+            if rejected is None:
+                raise
+            instrument.count("cpe.rejected")
+            rejected.append((str(e), details))
+            continue
         if leftover:
+            instrument.count("cpe.leftover_keys", len(leftover))
             print(f"Some unused keys/values in {leftover}, used {parsed_program}")
         ret.append(parsed_program)
+    instrument.count("cpe.records", len(ret))
     return ret
 
-def format_one_file(file_path):
-    out = []
+def _format_html(html_content, file_path, parser):
+    soup = make_soup(html_content, parser)
+    # contacts = _contacts(soup, file_path)
+    rejected = []
+    return _programs(soup, file_path, rejected), rejected
+
+@instrument.timed("cpe.format_one_file", label=lambda file_path, *args, **kwargs: file_path)
+def format_one_file(file_path, parser="html.parser", store=None, as_of=None):
+    """
+    Returns the programs of the file and the (reason, details) of the ones
+    that could not be parsed. With a store, file_path is the identifier of a
+    page in the snapshot store.
+    """
+    if store is not None:
+        return _format_html(read_snapshot(store, "cpe", file_path, as_of).decode("utf-8"), file_path, parser)
     if not file_path.endswith(".html"):
         raise ValueError(f"File must be an HTML file: {file_path}")
-    id = os.path.splitext(os.path.basename(file_path))[0]
     with open(file_path, "r") as html_content:
-        warnings.filterwarnings("ignore", category=DeprecationWarning)
-        soup = BeautifulSoup(html_content, "html.parser")
-        # contacts = _contacts(soup, file_path)
-        return _programs(soup, file_path)
+        return _format_html(html_content, file_path, parser)
     #     for contact in contacts:
     #         out.append(f"{id}\t{contact}\t{details}")
     # return out
         
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process HTML files in a CPE directory.")
-    parser.add_argument("input", help="Path to the input directory")
+    parser.add_argument("input", help="Glob of the input files, or of the page identifiers with --store")
     parser.add_argument("output", help="Path to the output file")
-    parser.add_argument("-e", "--exclude", help="Path to the TSV file to exclude")
+    parser.add_argument("-e", "--exclude", action="append", help="Path to a TSV file with emails to exclude, can be given more than once")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of processes to parse files with")
+    parser.add_argument("-p", "--parser", choices=PARSERS, default="html.parser", help="HTML parser backend")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="tsv", help="Output format, parquet and arrow need pyarrow")
+    parser.add_argument("-z", "--gzip", action="store_true", help="Compress the output with gzip, also done for paths ending in .gz")
+    parser.add_argument("-m", "--manifest", help="Path to a manifest caching parsed rows between runs")
+    parser.add_argument("--address-cache", help="Path to a SQLite file caching parsed addresses between runs")
+    parser.add_argument("--address-cache-size", type=int, default=100000, help="Number of parsed addresses kept in memory")
+    parser.add_argument("--store", help="Path to a snapshot store to read the pages from instead of files")
+    parser.add_argument("--as-of", type=timestamp, help="With --store, read the pages as they were at this ISO date and time")
+    parser.add_argument("--shard", type=shard, help="Only build shard i/N of the input files, combine the parts with merge_parts.py")
+    parser.add_argument("--quarantine", help="Path of a JSON lines file for the programs that could not be parsed, defaults to the output path with .quarantine.jsonl")
+    parser.add_argument("--checkpoint", help="Path to a checkpoint, a run that was stopped continues from it")
+    parser.add_argument("--checkpoint-every", type=float, default=30.0, help="Seconds between checkpoints")
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    instrument.enable_from_args(args)
 
-    ignore_emails = set()
+    ignore_emails = frozenset()
     if args.exclude:
-        idx = None
-        with open(args.exclude, "r") as f:
-            for i, line in enumerate(f):
-                if idx is None:
-                    headers = line.strip().split("\t")
-                    for j, header in enumerate(headers):
-                        if header.lower() == "email":
-                            idx = j
-                            break
-                if idx is not None and i > 0:
-                    items = line.strip().split("\t")
-                    email = items[idx]
-                    if email:
-                        ignore_emails.add(email)
-        if not ignore_emails:
-            raise ValueError(f"No emails found in the exclude file: {args.exclude}")
-        print(f"Loaded {len(ignore_emails)} emails to ignore")
+        ignore_emails = load_exclude_emails(args.exclude)
+        print(f"Loaded {len(ignore_emails)} emails to ignore from {len(args.exclude)} files")
 
     if not args.input or not args.output:
         raise ValueError("Input and output paths must be provided")
     
-    filenames = get_filenames(args.input)
+    if args.store:
+        if args.manifest:
+            raise ValueError("The manifest caches files on disk and can not be used with --store")
+        filenames = [filename for filename in SnapshotStore(args.store).identifiers("cpe", args.input, args.as_of) if in_shard(filename, args.shard)]
+    else:
+        filenames = get_filenames(args.input, args.shard)
     print(f"Processing {len(filenames)} files...")
-    out = []
-    for filename in tqdm(filenames):
-        id = os.path.splitext(os.path.basename(filename))[0]
-        new_rows = format_one_file(filename)
-        # print(new_rows)
-        for row in new_rows:
-            if row.email in ignore_emails:
-                print(f"Ignoring email: {row.email}")
-                continue
-            out.append(f"{id}\t{row}")
-    
-    header = f"ID\t{Program.header()}"
-
-    with open(args.output, "w") as f:
-        f.write(header + "\n")
-        for row in out:
-            f.write(row + "\n")
-    print(f"TSV file created: {args.output} with {len(out)} rows.")
+    checkpoint = None
+    state = None
+    todo = sort_by_id(filenames)
+    if args.checkpoint:
+        if not resumable(args.output, args.format, args.gzip):
+            raise ValueError("Only uncompressed TSV output can be checkpointed")
+        checkpoint = Checkpoint(args.checkpoint, (args.input, args.output, args.parser, args.exclude, args.store, args.as_of, args.shard), args.checkpoint_every)
+        todo, state = checkpoint.resume(filenames)
+    files_done = len(filenames) - len(todo)
+    configure_address_cache(args.address_cache_size, args.address_cache)
+    manifest = None
+    if args.manifest:
+        manifest = Manifest(args.manifest, code_version(__file__, models.__file__, parsers.__file__))
+    stats = {}
+    ignored = 0 if state is None else state["ignored"]
+    start = time.perf_counter()
+    quarantine = Quarantine(args.quarantine or f"{args.output}.quarantine.jsonl", state and state["quarantine_size"])
+    with open_writer(args.output, [("ID", str)] + Program.columns(), args.format, args.gzip, state and state["output_size"]) as writer, quarantine:
+        if state is not None:
+            writer.rows = state["rows"]
+            quarantine.count = state["quarantined"]
+        results = map_files(partial(format_one_file, parser=args.parser, store=args.store, as_of=args.as_of), todo, args.workers, stats, manifest, partial(instrument.worker_info, address_cache_info),
+                            partial(configure_address_cache, args.address_cache_size, args.address_cache))
+        for filename, (id, (new_rows, rejected)) in zip(todo, results):
+            for row in new_rows:
+                if ignore_emails and normalize_email(row.email) in ignore_emails:
+                    ignored += 1
+                    instrument.count("cpe.excluded")
+                    continue
+                writer.write([id, *row.values()])
+            for reason, details in rejected:
+                quarantine.add(filename, reason, details)
+            files_done += 1
+            if checkpoint is not None and checkpoint.due():
+                checkpoint.save(files_done, filename, {"output_size": writer.tell(), "rows": writer.rows, "ignored": ignored, "quarantine_size": quarantine.tell(), "quarantined": quarantine.count})
+    if checkpoint is not None:
+        checkpoint.remove()
+    if ignored:
+        print(f"Ignored {ignored} rows with excluded emails")
+    print(f"{args.format.upper()} file created: {args.output} with {writer.rows} rows.")
+    if manifest is not None:
+        if args.shard is None:
+            manifest.prune(filenames)
+        manifest.save()
+    print_throughput(stats, time.perf_counter() - start)
+    instrument.absorb(stats)
+    cache_info = sum_infos(stats)
+    if cache_info:
+        print(f"Address cache: {cache_info['hits']} memory hits, {cache_info['store_hits']} store hits, {cache_info['misses']} CRF parses")
@@ -1,18 +1,34 @@
 """
 Example usage:
 python3 make_cpe_spreadsheet.py "cpe_data/*.html" "cpe.tsv"
+python3 make_updateparishdata_spreadsheet.py --input "data/updateparishdata/*.json" --output churches.tsv --db churches.sqlite
 """
 import argparse
 import collections
-from dataclasses import dataclass
-import glob
+from dataclasses import dataclass, fields
+from functools import partial
+import io
 import json
 import os
+import re
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+from tqdm import tqdm
 import validators
-from models import Person, Phone
+from checkpoint import Checkpoint
+from church_store import ChurchStore
+import instrument
+from inputs import get_filenames, in_shard, shard
+from manifest import Manifest, code_version
+import models
+from models import Person, Phone, Record
+from output import FORMATS, Quarantine, open_writer, resumable
+from parallel import file_id, map_files, sort_by_id
+from snapshot_store import SnapshotStore, read_snapshot, timestamp
 
-from tqdm import tqdm
 
 def _remove_trailing_nonalpha(text):
     lasti = len(text) - 1
@@ -51,39 +67,33 @@ _PASTOR_TITLE_WORDS = ("Administrator", "Bishop", "Cardinal", "Deacon", "Dean",
 # abbreviations are followed by a period or a space
 _PASTOR_TITLE_ABBREVIATIONS = ("Dcn", "Dn", "Dr", "Fr", "GB", "Lm", "Mon", "Most", "Msgr", "Pbro", "Re", "Rev", "Rt", "V", "ev")
 
+# lowercased title -> title, words before abbreviations and each in tuple order,
+# which is also the order the alternation below tries them in
+_TITLES = {title.lower(): title for title in _PASTOR_TITLE_WORDS + _PASTOR_TITLE_ABBREVIATIONS}
+_TITLE_PATTERN = re.compile(
+    "(?:"
+    + "|".join(re.escape(title.lower()) for title in _PASTOR_TITLE_WORDS)
+    + ")(?= |$)|(?:"
+    + "|".join(re.escape(title.lower()) for title in _PASTOR_TITLE_ABBREVIATIONS)
+    + ")(?=[ .]|$)"
+)
+_TITLE_SPELLINGS = {"Farther": "Father", "Fathers": "Father", "(Administrator)": "Administrator"}
+
 def _startswith_title(identity):
-    lid = identity.lower()
-    # equal
-    for title in _PASTOR_TITLE_WORDS:
-        if lid == title.lower():
-            return title
-    for title in _PASTOR_TITLE_ABBREVIATIONS:
-        if lid == title.lower():
-            return title
-    # startswith
-    for title in _PASTOR_TITLE_WORDS:
-        if not lid.startswith(f"{title.lower()} "):
-            continue
-        return title
-    for title in _PASTOR_TITLE_ABBREVIATIONS:
-        if lid.startswith(f"{title.lower()} ") or lid.startswith(f"{title.lower()}."):
-            return title
-    return ""
+    match = _TITLE_PATTERN.match(identity.lower())
+    if match is None:
+        return ""
+    return _TITLES[match.group()]
 
 def _split_titles(identity):
     titles = []
-    while _startswith_title(identity):
-        t = _startswith_title(identity)
+    while t := _startswith_title(identity):
         identity = identity[len(t):]
         if identity.startswith("."):
             identity = identity[1:]
         identity = identity.strip()
         # fix spellings
-        if t == "Farther" or t == "Fathers":
-            t = "Father"
-        if t == "(Administrator)":
-            t = "Administrator"
-        titles.append(t)
+        titles.append(_TITLE_SPELLINGS.get(t, t))
     return " ".join(titles), identity
 
     
@@ -125,8 +135,35 @@ class Pastor:
 
 
 
-@dataclass
-class Church:
+@dataclass(slots=True)
+class Church(Record):
+    COLUMNS = (
+        ("id", "id"),
+        ("short_name", "short_name"),
+        ("full_name", "full_name"),
+        ("email", "email"),
+        ("title", "title"),
+        ("first", "first"),
+        ("middle", "middle"),
+        ("last", "last"),
+        ("raw_pastor_text", "raw_pastor_text"),
+        ("type_name", "type_name"),
+        ("diocese_name", "diocese_name"),
+        ("diocese_type_name", "diocese_type_name"),
+        ("rite_type_name", "rite_type_name"),
+        ("english", "english"),
+        ("language", "language"),
+        ("lat", "lat"),
+        ("lng", "lng"),
+        ("street", "street"),
+        ("state", "state"),
+        ("zip", "zip"),
+        ("phone", "phone"),
+        ("phone_ext", "phone_ext"),
+        ("website", "website"),
+        ("last_updated", "last_updated"),
+    )
+
     short_name: str = ""
     full_name: str = ""
     email: str = ""
@@ -144,6 +181,8 @@ class Church:
     lat: float = 0.0
     lng: float = 0.0
     street: str = ""
+    # not written to the spreadsheet
+    city: str = ""
     state: str = ""
     zip: str = ""
     phone: str = ""
@@ -153,6 +192,7 @@ class Church:
     id: str = ""
     
 
+    @instrument.timed("church.fill", label=lambda self, details_dict: details_dict.get("id"))
     def fill(self, details_dict):
         self.full_name = details_dict.pop("name", "")
         if self.full_name:
@@ -212,62 +252,323 @@ class Church:
             details_dict.pop(field, None)
 
         return details_dict
-    
-    @classmethod
-    def header(cls):
-        return "id\tshort_name\tfull_name\temail\ttitle\tfirst\tmiddle\tlast\traw_pastor_text\ttype_name\tdiocese_name\tdiocese_type_name\trite_type_name\tenglish\tlanguage\tlat\tlng\tstreet\tstate\tzip\tphone\tphone_ext\twebsite\tlast_updated"
-    
-    def __str__(self):
-        return f"{self.id}\t{self.short_name}\t{self.full_name}\t{self.email}\t{self.title}\t{self.first}\t{self.middle}\t{self.last}\t{self.raw_pastor_text}\t{self.type_name}\t{self.diocese_name}\t{self.diocese_type_name}\t{self.rite_type_name}\t{self.english}\t{self.language}\t{self.lat}\t{self.lng}\t{self.street}\t{self.state}\t{self.zip}\t{self.phone}\t{self.phone_ext}\t{self.website}\t{self.last_updated}"
 
-def get_filenames(file_pattern):
-    filenames = []
-    if os.path.isfile(file_pattern):
-        filenames.append(file_pattern)
-    else:
-        filenames.extend(glob.glob(file_pattern))
-    for filename in filenames:
-        if not os.path.exists(filename):
-            raise FileNotFoundError(f"File {filename} does not exist")
-    return filenames
+def _open_page(file_path, store=None, as_of=None):
+    if store is not None:
+        return io.BytesIO(read_snapshot(store, "updateparishdata", file_path, as_of))
+    return open(file_path, "rb")
+
+def iter_records(file_path, store=None, as_of=None):
+    """
+    Yields the records of a page file one at a time, without loading the whole
+    file when ijson is installed. With a store, file_path is the identifier of
+    a page in the snapshot store.
+    """
+    with _open_page(file_path, store, as_of) as file:
+        if ijson is not None:
+            yield from ijson.items(file, "item", use_float=True)
+        else:
+            yield from json.load(file)
+
+# json and ijson raise these for truncated or invalid pages
+_PAGE_ERRORS = (ValueError,) if ijson is None else (ValueError, ijson.JSONError)
+
+def _page_records(file_path, rejected, store=None, as_of=None):
+    """
+    Yields the records of a page like iter_records. A page that can not be read
+    to the end, like a truncated one, stops there and is added to rejected with
+    a None record.
+    """
+    try:
+        yield from iter_records(file_path, store, as_of)
+    except _PAGE_ERRORS as e:
+        instrument.count("church.bad_pages")
+        rejected.append((f"Could not read the page: {e}", None))
+
+def parse_record(record):
+    """
+    Raises ValueError for records with unknown keys or without an id.
+    """
+    parsed_church = Church()
+    leftover = parsed_church.fill(record)
+    if leftover:
+        instrument.count("church.leftover_keys", len(leftover))
+        raise ValueError(f"Some unused keys in {sorted(leftover)}")
+    if not parsed_church.id:
+        instrument.count("church.missing_ids")
+        raise ValueError("Church with no ID")
+    instrument.count("church.records")
+    return parsed_church
+
+def _parse_or_reject(record, rejected):
+    # fill pops from the record, keep the original for the quarantine
+    try:
+        return parse_record(dict(record))
+    except ValueError as e:
+        rejected.append((str(e), record))
+        return None
+
+@instrument.timed("updateparishdata.format_one_file", label=lambda file_path, *args, **kwargs: file_path)
+def format_one_file(file_path, store=None, as_of=None):
+    """
+    Returns the churches of a page file and the (reason, record) of the records
+    that could not be parsed.
+    """
+    churches = []
+    rejected = []
+    for record in _page_records(file_path, rejected, store, as_of):
+        parsed_church = _parse_or_reject(record, rejected)
+        if parsed_church is not None:
+            churches.append(parsed_church)
+    return churches, rejected
+
+def city_of(file_path):
+    """
+    City a page file was scraped for, see scrape_updateparishdata.request_id.
+    """
+    return re.sub(r"_page\d+$", "", file_id(file_path))
+
+def _last_update(church):
+    # pages have "last_update": null for some churches, written as None
+    return church.last_updated or ""
+
+def _merge_churches(primary, secondary):
+    for field in fields(Church):
+        if not getattr(primary, field.name):
+            setattr(primary, field.name, getattr(secondary, field.name))
+    return primary
+
+
+class ChurchDeduper:
+    """
+    Keeps one church per id, following a policy:
+        first: the first record read wins, churches are emitted right away.
+        newest: the record with the latest last_update wins.
+        merge: the newest record wins, with its empty fields filled from the others.
+    newest and merge keep the churches in memory until remaining() is called.
+    """
+    POLICIES = ("first", "newest", "merge")
+
+    def __init__(self, policy="first"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown dedupe policy {policy}, expected one of {self.POLICIES}")
+        self.policy = policy
+        self.ids = set()
+        self.kept = {}
+        self.records = collections.Counter()
+        self.duplicates = collections.Counter()
+        self.unparsed = 0
+
+    def is_known_duplicate(self, record, city):
+        """
+        Whether a raw record would lose against the kept one, so it need not be parsed.
+        """
+        church_id = record.get("id")
+        if self.policy == "first":
+            known = church_id in self.ids
+        elif self.policy == "newest":
+            kept = self.kept.get(church_id)
+            known = kept is not None and (record.get("last_update") or "") <= _last_update(kept)
+        else:
+            known = False
+        if known:
+            self.records[city] += 1
+            self.duplicates[city] += 1
+            self.unparsed += 1
+        return known
+
+    def add(self, church, city):
+        """
+        Returns the church if it can be written right away.
+        """
+        self.records[city] += 1
+        if church.id not in self.ids:
+            self.ids.add(church.id)
+            if self.policy == "first":
+                return church
+            self.kept[church.id] = church
+            return None
+        self.duplicates[city] += 1
+        if self.policy == "first":
+            return None
+        kept = self.kept[church.id]
+        newer = _last_update(church) > _last_update(kept)
+        if self.policy == "newest":
+            if newer:
+                self.kept[church.id] = church
+        elif newer:
+            self.kept[church.id] = _merge_churches(church, kept)
+        else:
+            _merge_churches(kept, church)
+        return None
+
+    def remaining(self):
+        return self.kept.values()
+
+    def report(self, path=None, top=20):
+        """
+        Duplicate rate of every city, highest first, written to path as TSV or
+        printed for the top cities.
+        """
+        rates = sorted(((self.duplicates[city] / count, city, count) for city, count in self.records.items()), reverse=True)
+        if path:
+            with open(path, "w") as f:
+                f.write("city\trecords\tduplicates\tduplicate_rate\n")
+                for rate, city, count in rates:
+                    f.write(f"{city}\t{count}\t{self.duplicates[city]}\t{rate:.4f}\n")
+            print(f"Duplicate report created: {path}")
+            return
+        for rate, city, count in rates[:top]:
+            print(f"{city}: {self.duplicates[city]} of {count} records duplicate ({rate:.1%})")
+
+def _file_churches(filename, deduper, quarantine, store, as_of):
+    city = city_of(filename)
+    rejected = []
+    for record in _page_records(filename, rejected, store, as_of):
+        if deduper.is_known_duplicate(record, city):
+            instrument.count("church.skipped_duplicates")
+            continue
+        parsed_church = _parse_or_reject(record, rejected)
+        if parsed_church is not None:
+            yield city, parsed_church
+    for reason, bad_record in rejected:
+        quarantine.add(filename, reason, bad_record)
+
+def stream_churches(filenames, deduper, quarantine, store=None, as_of=None):
+    """
+    Yields (filename, churches) for all files in order, where churches lazily
+    yields (city, church). Records the deduper already knows would lose are
+    dropped before any of the parsing work in Church.fill.
+    """
+    for filename in tqdm(sort_by_id(filenames)):
+        yield filename, _file_churches(filename, deduper, quarantine, store, as_of)
+
+def cached_churches(filenames, manifest, quarantine):
+    """
+    Yields (filename, churches) for all files in order through the manifest,
+    which caches whole files, so every record gets parsed.
+    """
+    results = map_files(format_one_file, filenames, cache=manifest)
+    for filename, (id, (parsed_churches, rejected)) in zip(sort_by_id(filenames), results):
+        for reason, record in rejected:
+            quarantine.add(filename, reason, record)
+        city = city_of(id)
+        yield filename, [(city, church) for church in parsed_churches]
+
+def _page_signature(filename, snapshots=None, as_of=None):
+    if snapshots is not None:
+        return snapshots.digest("updateparishdata", filename, as_of)
+    stat = os.stat(filename)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def ingest(db, filenames, quarantine, store=None, as_of=None):
+    """
+    Parses the pages that are new or changed since they were last ingested into
+    the church store db, returns their number.
+    """
+    snapshots = SnapshotStore(store) if store else None
+    signatures = {filename: _page_signature(filename, snapshots, as_of) for filename in sort_by_id(filenames)}
+    todo = db.pending(signatures)
+    results = map_files(partial(format_one_file, store=store, as_of=as_of), todo)
+    for filename, (id, (parsed_churches, rejected)) in zip(todo, results):
+        for reason, record in rejected:
+            quarantine.add(filename, reason, record)
+        db.ingest(filename, signatures[filename], [church.values() for church in parsed_churches])
+    return len(todo)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process json files scraped.")
-    parser.add_argument("--input", help="Path to the input directory")
+    parser.add_argument("--input", help="Glob of the input files, or of the page identifiers with --store")
     parser.add_argument("--output", help="Path to the output file")
+    parser.add_argument("--format", choices=FORMATS, default="tsv", help="Output format, parquet and arrow need pyarrow")
+    parser.add_argument("--gzip", action="store_true", help="Compress the output with gzip, also done for paths ending in .gz")
+    parser.add_argument("--manifest", help="Path to a manifest caching parsed rows between runs")
+    parser.add_argument("--dedupe", choices=ChurchDeduper.POLICIES, help="Which record to keep for churches found more than once, defaults to first, or newest with --db")
+    parser.add_argument("--dedupe-report", help="Path to write the duplicate rate of every city to, as TSV")
+    parser.add_argument("--store", help="Path to a snapshot store to read the pages from instead of files")
+    parser.add_argument("--as-of", type=timestamp, help="With --store, read the pages as they were at this ISO date and time")
+    parser.add_argument("--shard", type=shard, help="Only build shard i/N of the input files, combine the parts with merge_parts.py --unique and the same --dedupe")
+    parser.add_argument("--quarantine", help="Path of a JSON lines file for the records that could not be parsed, defaults to the output path with .quarantine.jsonl")
+    parser.add_argument("--checkpoint", help="Path to a checkpoint, a run that was stopped continues from it")
+    parser.add_argument("--checkpoint-every", type=float, default=30.0, help="Seconds between checkpoints")
+    parser.add_argument("--db", help="Path to a church store, only pages that are new or changed since the last run are parsed")
+    instrument.add_arguments(parser)
     args = parser.parse_args()
-
-
-    filenames = get_filenames(args.input)
+    instrument.enable_from_args(args)
+    if args.dedupe is None:
+        args.dedupe = "newest" if args.db else "first"
+
+    if args.store:
+        if args.manifest:
+            raise ValueError("The manifest caches files on disk and can not be used with --store")
+        filenames = [filename for filename in SnapshotStore(args.store).identifiers("updateparishdata", args.input or "*", args.as_of) if in_shard(filename, args.shard)]
+    else:
+        filenames = get_filenames(args.input, args.shard)
     print(f"Processing {len(filenames)} files...")
 
-    churches = {}
-    nrecords = 0
-    emails = set()
-
-    for filename in tqdm(filenames):
-        with open(filename, 'r') as file:
-            data = json.load(file)
-            for record in data:
-                parsed_church = Church()
-                nrecords += 1
-                leftover = parsed_church.fill(record)
-                if leftover:
-                    print(f"Some unused keys in {leftover}")
-                    exit(0)
-                if not parsed_church.id:
-                    print(f"Church with no ID: {parsed_church}")
-                    exit(0)
-                if parsed_church.id and id not in churches:
-                    churches[parsed_church.id] = parsed_church
-                emails.add(parsed_church.email)
-    
-    print(f"Found {len(churches)} churches in {nrecords} records")
-    print(f"Found {len(emails)} unique emails")
-
-
-    with open(args.output, "w") as f:
-        f.write(Church.header() + "\n")
-        for church in churches.values():
-            f.write(str(church) + "\n")
-    print(f"TSV file created: {args.output} with {len(churches)} rows.")
+    if args.db:
+        if args.manifest or args.checkpoint:
+            raise ValueError("The church store keeps track of the pages it ingested, --manifest and --checkpoint are not needed with --db")
+        if args.dedupe != "newest":
+            raise ValueError("The church store keeps the newest record of every church, only --dedupe newest can be used with --db")
+        with ChurchStore(args.db, Church.columns()) as db:
+            with Quarantine(args.quarantine or f"{args.output}.quarantine.jsonl") as quarantine:
+                pages = ingest(db, filenames, quarantine, args.store, args.as_of)
+            churches, emails, npages, nrecords = db.stats()
+            print(f"Ingested {pages} new or changed pages, {len(filenames) - pages} unchanged")
+            print(f"Found {churches} churches in {nrecords} records of {npages} pages")
+            print(f"Found {emails} unique emails")
+            writer = db.export(args.output, args.format, args.gzip)
+        print(f"{args.format.upper()} file created: {args.output} with {writer.rows} rows.")
+    else:
+        manifest = None
+        if args.manifest:
+            manifest = Manifest(args.manifest, code_version(__file__, models.__file__))
+
+        checkpoint = None
+        state = None
+        todo = sort_by_id(filenames)
+        if args.checkpoint:
+            if not resumable(args.output, args.format, args.gzip):
+                raise ValueError("Only uncompressed TSV output can be checkpointed")
+            checkpoint = Checkpoint(args.checkpoint, (args.input, args.output, args.dedupe, args.store, args.as_of, args.shard), args.checkpoint_every)
+            todo, state = checkpoint.resume(filenames)
+        files_done = len(filenames) - len(todo)
+
+        deduper = ChurchDeduper(args.dedupe) if state is None else state["deduper"]
+        emails = set() if state is None else state["emails"]
+
+        quarantine = Quarantine(args.quarantine or f"{args.output}.quarantine.jsonl", state and state["quarantine_size"])
+        with open_writer(args.output, Church.columns(), args.format, args.gzip, state and state["output_size"]) as writer, quarantine:
+            if state is not None:
+                writer.rows = state["rows"]
+                quarantine.count = state["quarantined"]
+            if manifest is not None:
+                files = cached_churches(todo, manifest, quarantine)
+            else:
+                files = stream_churches(todo, deduper, quarantine, args.store, args.as_of)
+            for filename, churches in files:
+                for city, parsed_church in churches:
+                    emails.add(parsed_church.email)
+                    parsed_church = deduper.add(parsed_church, city)
+                    if parsed_church is not None:
+                        writer.write(parsed_church.values())
+                files_done += 1
+                if checkpoint is not None and checkpoint.due():
+                    checkpoint.save(files_done, filename, {"output_size": writer.tell(), "rows": writer.rows, "quarantine_size": quarantine.tell(), "quarantined": quarantine.count, "deduper": deduper, "emails": emails})
+            for parsed_church in deduper.remaining():
+                writer.write(parsed_church.values())
+        if checkpoint is not None:
+            checkpoint.remove()
+
+        nrecords = sum(deduper.records.values())
+        nduplicates = sum(deduper.duplicates.values())
+        print(f"Found {writer.rows} churches in {nrecords} records")
+        print(f"Found {len(emails)} unique emails")
+        print(f"Dropped {nduplicates} duplicate records ({nduplicates / max(1, nrecords):.1%}), {deduper.unparsed} of them without parsing")
+        deduper.report(args.dedupe_report)
+        print(f"{args.format.upper()} file created: {args.output} with {writer.rows} rows.")
+        if manifest is not None:
+            if args.shard is None:
+                manifest.prune(filenames)
+            manifest.save()
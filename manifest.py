@@ -0,0 +1,84 @@
+"""
+On-disk manifest caching the parsed rows of every input file, so reruns of the
+spreadsheet builders only parse new or changed files.
+
+Entries are keyed by file path and checked against the file size and mtime. If
+those changed, the content hash decides whether the cached rows are still
+good. The whole manifest is dropped when the parser code version changes.
+Rows are kept pickled, so callers are free to modify the rows they get back.
+"""
+import hashlib
+import os
+import pickle
+import zlib
+
+
+def code_version(*source_paths):
+    """
+    Hash of the source files that turn an input file into rows.
+    """
+    digest = hashlib.sha1()
+    for path in source_paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def content_hash(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                saved = pickle.loads(zlib.decompress(f.read()))
+            if saved["version"] == version:
+                self.entries = saved["entries"]
+            else:
+                print(f"Parser code changed, ignoring manifest {path}")
+
+    def lookup(self, file_path):
+        """
+        Returns the cached rows of file_path, or None if it has to be parsed.
+        """
+        entry = self.entries.get(file_path)
+        if entry is None:
+            self.misses += 1
+            return None
+        size, mtime, digest, data = entry
+        stat = os.stat(file_path)
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+            if stat.st_size != size or content_hash(file_path) != digest:
+                self.misses += 1
+                return None
+            self.entries[file_path] = (stat.st_size, stat.st_mtime_ns, digest, data)
+        self.hits += 1
+        return pickle.loads(data)
+
+    def store(self, file_path, rows):
+        stat = os.stat(file_path)
+        self.entries[file_path] = (stat.st_size, stat.st_mtime_ns, content_hash(file_path), pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def prune(self, file_paths):
+        """
+        Drops entries of files that are no longer part of the input.
+        """
+        keep = set(file_paths)
+        self.entries = {path: entry for path, entry in self.entries.items() if path in keep}
+
+    def save(self):
+        data = zlib.compress(pickle.dumps({"version": self.version, "entries": self.entries}, protocol=pickle.HIGHEST_PROTOCOL))
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+        print(f"Manifest {self.path}: {self.hits} files reused, {self.misses} parsed")
@@ -0,0 +1,125 @@
+"""
+Combines the part outputs of a build split with --shard into one TSV.
+
+Rows are ordered by a key column, by default the first one. Parts already in
+key order, like the CPE and ACPE outputs, are merged as streams. Other parts
+are sorted in memory first. Rows with the same key keep the order they have in
+their part, and the order of the parts on the command line. The result only
+depends on the rows, not on how they were split into parts.
+
+With --unique one row is kept per key. Church parts built with --dedupe newest
+or merge are combined with the same policy, so the newest record wins across
+parts too.
+
+Example usage:
+python3 merge_parts.py cpe.tsv cpe.part*.tsv
+python3 merge_parts.py churches.tsv churches.part*.tsv --unique
+python3 merge_parts.py churches.tsv churches.part*.tsv --unique --dedupe newest
+"""
+import argparse
+import heapq
+import itertools
+
+from make_updateparishdata_spreadsheet import Church, ChurchDeduper
+from output import TsvWriter, open_tsv
+
+_CHURCH_TYPES = [(attribute, column_type) for (attribute, _), (_, column_type) in zip(Church.COLUMNS, Church.columns())]
+
+
+def _header(path):
+    with open_tsv(path) as f:
+        return f.readline().rstrip("\n")
+
+def _rows(path, key_index):
+    with open_tsv(path) as f:
+        f.readline()
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            yield fields[key_index], fields
+
+def _is_sorted(path, key_index):
+    previous = None
+    for key, _ in _rows(path, key_index):
+        if previous is not None and key < previous:
+            return False
+        previous = key
+    return True
+
+def _part(path, key_index):
+    if _is_sorted(path, key_index):
+        return _rows(path, key_index)
+    print(f"{path} is not ordered by key, sorting it in memory")
+    return iter(sorted(_rows(path, key_index), key=lambda row: row[0]))
+
+def _church(fields):
+    """
+    Church of a TSV row, with the values turned back into the column types.
+    """
+    church = Church()
+    for (attribute, column_type), value in zip(_CHURCH_TYPES, fields):
+        if value == "None":
+            value = None
+        elif column_type is bool:
+            value = value == "True"
+        elif column_type is float:
+            value = float(value)
+        setattr(church, attribute, value)
+    return church
+
+def _kept_row(rows, dedupe):
+    if dedupe == "first" or len(rows) == 1:
+        return rows[0]
+    deduper = ChurchDeduper(dedupe)
+    for fields in rows:
+        deduper.add(_church(fields), "")
+    kept, = deduper.remaining()
+    return kept.values()
+
+def merge_parts(output, parts, key=None, unique=False, compress=False, dedupe="first"):
+    """
+    Writes the rows of all parts to output in key order and returns the writer
+    and the number of rows dropped. With unique one row of every key is kept,
+    picked by the ChurchDeduper policy dedupe. Only the first policy works for
+    parts other than churches.
+    """
+    header = _header(parts[0])
+    for part in parts[1:]:
+        if _header(part) != header:
+            raise ValueError(f"Header of {part} does not match the header of {parts[0]}")
+    columns = header.split("\t")
+    if key is None:
+        key = columns[0]
+    if key not in columns:
+        raise ValueError(f"Key column {key} is not in the header of {parts[0]}")
+    key_index = columns.index(key)
+    if unique and dedupe != "first" and (header != Church.header() or key != "id"):
+        raise ValueError(f"--dedupe {dedupe} needs church parts keyed by id")
+
+    streams = [_part(part, key_index) for part in parts]
+    duplicates = 0
+    with TsvWriter(output, header, compress) as writer:
+        # rows come in key order, so the rows of a key are next to each other
+        for _, group in itertools.groupby(heapq.merge(*streams, key=lambda row: row[0]), key=lambda row: row[0]):
+            rows = [fields for _, fields in group]
+            if not unique:
+                for fields in rows:
+                    writer.write(fields)
+                continue
+            duplicates += len(rows) - 1
+            writer.write(_kept_row(rows, dedupe))
+    return writer, duplicates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the part outputs of a sharded build into one TSV file.")
+    parser.add_argument("output", help="Path to the output file")
+    parser.add_argument("parts", nargs="+", help="Paths to the part outputs, TSV or gzip compressed TSV")
+    parser.add_argument("-k", "--key", help="Column to order the rows by, defaults to the first column")
+    parser.add_argument("-u", "--unique", action="store_true", help="Only keep one row of every key, for churches found in more than one shard")
+    parser.add_argument("--dedupe", choices=ChurchDeduper.POLICIES, default="first", help="Which row to keep with --unique, the --dedupe policy the church parts were built with")
+    parser.add_argument("-z", "--gzip", action="store_true", help="Compress the output with gzip, also done for paths ending in .gz")
+    args = parser.parse_args()
+
+    writer, duplicates = merge_parts(args.output, args.parts, args.key, args.unique, args.gzip, args.dedupe)
+    if duplicates:
+        print(f"Dropped {duplicates} rows with a key already written")
+    print(f"TSV file created: {args.output} with {writer.rows} rows from {len(args.parts)} parts.")
@@ -1,7 +1,42 @@
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+import json
+import os
 import re
+import sqlite3
 import usaddress
 
+import instrument
+
+_NON_DIGITS = re.compile(r'\D')
+_NON_NAME_CHARS = re.compile(r'[^a-zA-Z-]')
+
+
+class Record:
+    """
+    Base of the rows written to the spreadsheets. Subclasses list their COLUMNS
+    as (attribute, header) pairs, and both header() and __str__ follow it.
+    """
+    __slots__ = ()
+    COLUMNS = ()
+
+    @classmethod
+    def header(cls):
+        return "\t".join(header for _, header in cls.COLUMNS)
+
+    @classmethod
+    def columns(cls):
+        """
+        (header, python type) of every column, for the typed output formats.
+        """
+        types = {field.name: field.type for field in fields(cls)}
+        return [(header, types[attribute]) for attribute, header in cls.COLUMNS]
+
+    def values(self):
+        return [getattr(self, attribute) for attribute, _ in self.COLUMNS]
+
+    def __str__(self):
+        return "\t".join(str(value) for value in self.values())
 
 def _break_full_name(full_identity):
     if not full_identity:
@@ -17,8 +52,17 @@ def _break_full_name(full_identity):
     else:
         return names[0], " ".join(names[1:-1]), names[-1]
 
-@dataclass
-class Contact:
+@dataclass(slots=True)
+class Contact(Record):
+    COLUMNS = (
+        ("first_name", "First Name"),
+        ("middle_name", "Middle Name"),
+        ("last_name", "Last Name"),
+        ("email", "Email"),
+        ("phone", "Phone"),
+        ("phone_ext", "Phone Ext"),
+    )
+
     full_name: str
     email: str
     phone: str
@@ -27,26 +71,30 @@ class Contact:
     middle_name: str
     last_name: str
 
-    def __init__(self, text_list):
+    def __init__(self, text_list, name_parts=None, phone_parts=None):
+        """
+        name_parts and phone_parts are the already normalized name and phone,
+        see break_full_names and parse_phones.
+        """
         if len(text_list) < 2:
             raise ValueError("Expected name and email in contact")
         self.full_name = text_list[0]
-        self.first_name, self.middle_name, self.last_name = _break_full_name(self.full_name)
+        self.first_name, self.middle_name, self.last_name = name_parts or _break_full_name(self.full_name)
         self.email = text_list[1]
         if len(text_list) > 2:
-            phone = Phone(text_list[2])
-            self.phone = phone.number
-            self.phone_ext = phone.extension
+            self.phone, self.phone_ext = phone_parts or _phone_parts(text_list[2])
         else:
             self.phone = ""
             self.phone_ext = ""
 
-    def __str__(self):
-        return f"{self.first_name}\t{self.middle_name}\t{self.last_name}\t{self.email}\t{self.phone}\t{self.phone_ext}"
-    
     @classmethod
-    def header(cls):
-        return "First Name\tMiddle Name\tLast Name\tEmail\tPhone\tPhone Ext"
+    def from_rows(cls, text_lists):
+        """
+        Contacts of a whole table, normalizing all names and phones in one batch.
+        """
+        names = break_full_names([text_list[0] if text_list else "" for text_list in text_lists])
+        phones = parse_phones([text_list[2] if len(text_list) > 2 else "" for text_list in text_lists])
+        return [cls(text_list, name_parts, phone_parts) for text_list, name_parts, phone_parts in zip(text_lists, names, phones)]
 
 @dataclass
 class Person:
@@ -55,7 +103,7 @@ class Person:
     last: str
 
     def __init__(self, names):
-        names = [re.sub(r'[^a-zA-Z-]', '', name.capitalize()) for name in names]
+        names = [_NON_NAME_CHARS.sub('', name.capitalize()) for name in names]
         if len(names) == 1:
             self.first = names[0]
             self.middle = ""
@@ -75,21 +123,41 @@ class Phone:
     extension: str
 
     def __init__(self, s):
-        digits = re.findall(r'\d', s)
-        
-        if len(digits) < 10:
-            self.number = ""
-            self.extension = ""
-            return
-        
-        if len(digits) == 10 or len(digits) == 11:
-            self.number = "".join(digits)
-            self.extension = ""
-            return
-        
-        all_digits = "".join(digits)
-        self.number = all_digits[:10]
-        self.extension = all_digits[10:]
+        self.number, self.extension = _phone_parts(s)
+
+def _phone_parts(s):
+    digits = _NON_DIGITS.sub('', s)
+    if len(digits) < 10:
+        return "", ""
+    if len(digits) == 10 or len(digits) == 11:
+        return digits, ""
+    return digits[:10], digits[10:]
+
+def _batch(func, values):
+    """
+    Applies func once per distinct value, columns of phones and emails repeat a lot.
+    """
+    results = {}
+    return [results[value] if value in results else results.setdefault(value, func(value)) for value in values]
+
+def parse_phones(texts):
+    """
+    (number, extension) of every phone text, same as Phone.
+    """
+    return _batch(_phone_parts, texts)
+
+def break_full_names(full_identities):
+    """
+    (first, middle, last) of every full name, same as _break_full_name.
+    """
+    return _batch(_break_full_name, full_identities)
+
+def emails_to_people(emails):
+    """
+    Guessed Person (or None) of every email, same as email_to_person.
+    Equal emails share one Person object.
+    """
+    return _batch(email_to_person, emails)
 
 def _email_to_person(address, separator="."):
     parts = address.split(separator)
@@ -108,9 +176,81 @@ def email_to_person(email):
     else:
         return None
 
+class AddressCache:
+    """
+    Bounded LRU cache of parse_address results, optionally backed by a SQLite
+    file that is shared between processes and runs.
+    """
+    def __init__(self, maxsize=100000, store_path=None):
+        self.maxsize = maxsize
+        self.store_path = store_path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self._store = None
+        self._store_pid = None
+
+    def _connection(self):
+        # sqlite connections can not be shared with forked worker processes
+        if self._store is None or self._store_pid != os.getpid():
+            self._store = sqlite3.connect(self.store_path, timeout=30)
+            self._store.execute("PRAGMA journal_mode=WAL")
+            self._store.execute("CREATE TABLE IF NOT EXISTS addresses (address TEXT PRIMARY KEY, parsed TEXT)")
+            self._store_pid = os.getpid()
+        return self._store
+
+    def get(self, address_string):
+        """
+        Returns (found, parsed).
+        """
+        if address_string in self.entries:
+            self.entries.move_to_end(address_string)
+            self.hits += 1
+            return True, self.entries[address_string]
+        if self.store_path:
+            row = self._connection().execute("SELECT parsed FROM addresses WHERE address = ?", (address_string,)).fetchone()
+            if row is not None:
+                self.store_hits += 1
+                parsed = json.loads(row[0])
+                self._remember(address_string, parsed)
+                return True, parsed
+        self.misses += 1
+        return False, None
+
+    def put(self, address_string, parsed):
+        self._remember(address_string, parsed)
+        if self.store_path:
+            with self._connection() as connection:
+                connection.execute("INSERT OR REPLACE INTO addresses VALUES (?, ?)", (address_string, json.dumps(parsed)))
+
+    def _remember(self, address_string, parsed):
+        self.entries[address_string] = parsed
+        self.entries.move_to_end(address_string)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def info(self):
+        return {"hits": self.hits, "store_hits": self.store_hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize}
+
+_address_cache = AddressCache()
+
+def configure_address_cache(maxsize=100000, store_path=None):
+    global _address_cache
+    _address_cache = AddressCache(maxsize, store_path)
+
+def address_cache_info():
+    """
+    Hit/miss counts of the parse_address cache in this process. Misses are the
+    calls that went to the usaddress CRF tagger.
+    """
+    return _address_cache.info()
+
+@instrument.timed("parse_address", label=lambda address_string: address_string)
 def parse_address(address_string):
     """
     This function parses an address string into street, city, state, and zip using usaddress library.
+    Results are memoized in the address cache, see configure_address_cache.
 
     Args:
         address_string: The address string to parse.
@@ -118,6 +258,19 @@ def parse_address(address_string):
     Returns:
         A dictionary containing keys 'street', 'city', 'state', and 'zip', or None if parsing fails.
     """
+    if not address_string:
+        return None
+    found, parsed = _address_cache.get(address_string)
+    instrument.count("parse_address.cache_hits" if found else "parse_address.cache_misses")
+    if not found:
+        parsed = _parse_address(address_string)
+        if parsed is None:
+            instrument.count("parse_address.failures")
+        _address_cache.put(address_string, parsed)
+    # callers pop from the returned dict, so never hand out the cached one
+    return dict(parsed) if parsed is not None else None
+
+def _parse_address(address_string):
     # Parse the address using usaddress.tag
     if not address_string:
         return None
@@ -145,8 +298,23 @@ def parse_address(address_string):
         ret_dict['street'] = f"{start}, {ret_dict['street']}"
         return ret_dict
 
-@dataclass
-class ProgramDetails:
+@dataclass(slots=True)
+class ProgramDetails(Record):
+    COLUMNS = (
+        ("account_name", "Account Name"),
+        ("program_type", "Program Type"),
+        ("street", "Street"),
+        ("city", "City"),
+        ("state", "State/Province Code"),
+        ("zip", "Zip/Postal Code"),
+        ("account_phone", "Account Phone"),
+        ("account_phone_ext", "Account Phone Ext"),
+        ("account_fax", "Account Fax"),
+        ("account_fax_ext", "Account Fax Ext"),
+        ("website", "Website"),
+        ("other_email", "Other Email"),
+    )
+
     account_name: str
     program_type: str
     street: str
@@ -195,10 +363,3 @@ class ProgramDetails:
             if field:
                 count += 1
         return count
-
-    @classmethod
-    def header(cls):
-        return "Account Name\tProgram Type\tStreet\tCity\tState/Province Code\tZip/Postal Code\tAccount Phone\tAccount Phone Ext\tAccount Fax\tAccount Fax Ext\tWebsite"
-    
-    def __str__(self):
-        return f"{self.account_name}\t{self.program_type}\t{self.street}\t{self.city}\t{self.state}\t{self.zip}\t{self.account_phone}\t{self.account_phone_ext}\t{self.account_fax}\t{self.account_fax_ext}\t{self.website}\t{self.other_email}"
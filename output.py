@@ -0,0 +1,195 @@
+"""
+Streaming output for the spreadsheet builders.
+
+Rows are written as they are produced, instead of being collected in memory
+until the end of the run. TSV goes through a buffered (optionally gzip
+compressed) file. Parquet and Arrow are written in typed record batches and
+need pyarrow. Rejected input records go to a JSON lines quarantine file.
+"""
+import gzip
+import io
+import json
+import os
+
+FORMATS = ("tsv", "parquet", "arrow")
+
+_BUFFER_SIZE = 1 << 20
+_BATCH_SIZE = 10000
+
+
+class _RowWriter:
+    def __init__(self):
+        self.rows = 0
+
+    def write(self, fields):
+        self._write(fields)
+        self.rows += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TsvWriter(_RowWriter):
+    """
+    Args:
+        path: Output file, compressed with gzip if it ends with .gz or compress is set.
+        header: Header line, without the trailing newline.
+        compress: Force gzip compression.
+        resume_at: Size returned by tell() when the run was checkpointed, the file
+            is cut back to it and appended to. Only for uncompressed files.
+    """
+    def __init__(self, path, header, compress=False, resume_at=None):
+        super().__init__()
+        self.path = path
+        if compress or path.endswith(".gz"):
+            if resume_at is not None:
+                raise ValueError(f"Compressed output cannot be resumed: {path}")
+            self.file = io.TextIOWrapper(io.BufferedWriter(gzip.open(path, "wb"), _BUFFER_SIZE), encoding="utf-8")
+        elif resume_at is not None:
+            os.truncate(path, resume_at)
+            self.file = open(path, "a", buffering=_BUFFER_SIZE)
+            return
+        else:
+            self.file = open(path, "w", buffering=_BUFFER_SIZE)
+        self.file.write(header + "\n")
+
+    def _write(self, fields):
+        self.file.write("\t".join(str(field) for field in fields) + "\n")
+
+    def tell(self):
+        """
+        Flushes the file and returns its size.
+        """
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowWriter(_RowWriter):
+    """
+    Writes typed columns in record batches, as Parquet or as an Arrow IPC file
+    that can be memory-mapped with pyarrow.memory_map and pyarrow.ipc.open_file.
+
+    Args:
+        path: Output file.
+        columns: (name, python type) of every column, str, float, int or bool.
+        format: parquet or arrow.
+    """
+    def __init__(self, path, columns, format="parquet", batch_size=_BATCH_SIZE):
+        super().__init__()
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError(f"pyarrow is needed to write {format} output") from None
+        self.pa = pa
+        types = {str: pa.string(), float: pa.float64(), int: pa.int64(), bool: pa.bool_()}
+        self.schema = pa.schema([(name, types[column_type]) for name, column_type in columns])
+        self.batch_size = batch_size
+        self.columns = [[] for _ in columns]
+        self.path = path
+        if format == "parquet":
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, self.schema)
+        elif format == "arrow":
+            self.writer = pa.ipc.new_file(path, self.schema)
+        else:
+            raise ValueError(f"Unknown columnar format {format}")
+
+    def _write(self, fields):
+        for column, field in zip(self.columns, fields):
+            column.append(field)
+        if len(self.columns[0]) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self.columns[0]:
+            return
+        arrays = []
+        for column, field in zip(self.columns, self.schema):
+            # the scraped JSON sometimes has numbers where the models declare str, like church ids,
+            # and nulls, like last_update, which stay nulls
+            if field.type == self.pa.string():
+                column = [value if value is None or isinstance(value, str) else str(value) for value in column]
+            arrays.append(self.pa.array(column, type=field.type))
+        batch = self.pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        self.writer.write_batch(batch)
+        self.columns = [[] for _ in self.columns]
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+def open_writer(path, columns, format="tsv", compress=False, resume_at=None):
+    """
+    Args:
+        columns: (name, python type) of every column.
+        format: One of FORMATS.
+        compress: gzip the TSV output.
+        resume_at: See TsvWriter, only TSV output can be resumed.
+    """
+    if format == "tsv":
+        return TsvWriter(path, "\t".join(name for name, _ in columns), compress, resume_at)
+    if resume_at is not None:
+        raise ValueError(f"{format} output cannot be resumed: {path}")
+    return ArrowWriter(path, columns, format)
+
+def resumable(path, format="tsv", compress=False):
+    return format == "tsv" and not compress and not path.endswith(".gz")
+
+def open_tsv(path):
+    """
+    Opens a TSV file for reading, gzip compressed if it ends with .gz.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+class Quarantine:
+    """
+    JSON lines file of the records that could not be turned into rows, with the
+    file they came from and why. The file is only created once a record is
+    rejected, and a leftover one from an earlier run is removed.
+
+    Args:
+        path: Quarantine file.
+        resume_at: Size returned by tell() when the run was checkpointed.
+    """
+    def __init__(self, path, resume_at=None):
+        self.path = path
+        self.count = 0
+        self.file = None
+        if resume_at is not None and os.path.exists(path):
+            os.truncate(path, resume_at)
+            self.file = open(path, "a")
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def add(self, source, reason, record):
+        if self.file is None:
+            self.file = open(self.path, "a")
+        self.file.write(json.dumps({"source": source, "reason": reason, "record": record}, default=str) + "\n")
+        self.count += 1
+
+    def tell(self):
+        if self.file is None:
+            return 0
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        if self.count:
+            print(f"Quarantined {self.count} records in {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,95 @@
+"""
+Helpers to spread per-file parsing over a process pool.
+
+Results always come back sorted by the ID taken from the filename, so the
+output of a run does not depend on the number of workers.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+
+from tqdm import tqdm
+
+import instrument
+
+
+def file_id(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+def sort_by_id(filenames):
+    return sorted(filenames, key=lambda filename: (file_id(filename), filename))
+
+def _timed_call(func, file_path, info_func=None):
+    start = time.perf_counter()
+    result = func(file_path)
+    seconds = time.perf_counter() - start
+    info = info_func() if info_func is not None else None
+    return os.getpid(), seconds, info, result
+
+def map_files(func, filenames, workers=1, stats=None, cache=None, info_func=None, initializer=None):
+    """
+    Yields (id, result) for every file, ordered by file ID.
+
+    Args:
+        func: Module level function taking a file path, so it can be pickled.
+        filenames: Paths to process.
+        workers: Number of processes, 1 runs everything in this process.
+        stats: Optional dict that is filled with {pid: [nfiles, seconds, info]}.
+        cache: Optional manifest.Manifest, files it already has results for are not parsed again.
+        info_func: Optional module level function called in the worker after every file,
+            its latest return value per worker ends up in stats.
+        initializer: Optional module level function called in every worker before its
+            first file, for settings of the parent that spawned workers would not inherit.
+    """
+    filenames = sort_by_id(filenames)
+    if stats is None:
+        stats = {}
+    cached = {}
+    if cache is not None:
+        for filename in filenames:
+            result = cache.lookup(filename)
+            if result is not None:
+                cached[filename] = result
+        instrument.count("manifest.hits", len(cached))
+    todo = [filename for filename in filenames if filename not in cached]
+    if workers <= 1:
+        results = (_timed_call(func, filename, info_func) for filename in todo)
+        yield from _collect(filenames, cached, results, stats, cache)
+        return
+    chunksize = max(1, min(64, len(todo) // (workers * 8)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+        results = executor.map(_timed_call, [func] * len(todo), todo, [info_func] * len(todo), chunksize=chunksize)
+        yield from _collect(filenames, cached, results, stats, cache)
+
+def _collect(filenames, cached, results, stats, cache):
+    for filename in tqdm(filenames):
+        if filename in cached:
+            yield file_id(filename), cached[filename]
+            continue
+        pid, seconds, info, result = next(results)
+        stats.setdefault(pid, [0, 0.0, None])
+        stats[pid][0] += 1
+        stats[pid][1] += seconds
+        stats[pid][2] = info
+        if cache is not None:
+            cache.store(filename, result)
+        yield file_id(filename), result
+
+def print_throughput(stats, wall_seconds):
+    total = sum(nfiles for nfiles, _, _ in stats.values())
+    for i, (pid, (nfiles, seconds, _)) in enumerate(sorted(stats.items())):
+        rate = nfiles / seconds if seconds else 0.0
+        print(f"Worker {i} (pid {pid}): {nfiles} files in {seconds:.2f}s, {rate:.1f} files/s")
+    rate = total / wall_seconds if wall_seconds else 0.0
+    print(f"Total: {total} files in {wall_seconds:.2f}s wall, {rate:.1f} files/s")
+
+def sum_infos(stats):
+    """
+    Adds up the numeric values of the info dicts the workers reported through info_func.
+    """
+    total = {}
+    for _, _, info in stats.values():
+        for key, value in (info or {}).items():
+            if isinstance(value, (int, float)):
+                total[key] = total.get(key, 0) + value
+    return total
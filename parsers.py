@@ -0,0 +1,117 @@
+"""
+HTML parser backends for the CPE/ACPE extractors.
+
+Every backend returns an object with the small part of the BeautifulSoup API
+that the extractors use (find, find_all, find_next, find_next_sibling, get,
+name and text), so the extraction code is the same for all of them.
+
+html.parser and lxml go through BeautifulSoup. selectolax parses with the
+Lexbor engine and wraps its nodes in LexborTag.
+"""
+import warnings
+
+from bs4 import BeautifulSoup
+
+PARSERS = ("html.parser", "lxml", "selectolax")
+
+
+def make_soup(html_content, parser="html.parser", parse_only=None):
+    """
+    parse_only is a SoupStrainer restricting which tags get built. It is
+    ignored by selectolax, which always parses the whole document.
+    """
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown parser {parser}, expected one of {PARSERS}")
+    if hasattr(html_content, "read"):
+        html_content = html_content.read()
+    if parser == "selectolax":
+        from selectolax.lexbor import LexborHTMLParser
+        return LexborTag(LexborHTMLParser(html_content).root, document=True)
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    return BeautifulSoup(html_content, parser, parse_only=parse_only)
+
+def _is_element(node):
+    return not node.tag.startswith("-")
+
+def _string(node):
+    """
+    Same as Tag.string in BeautifulSoup: the text of a node with exactly one child,
+    following single element children down.
+    """
+    children = list(node.iter(include_text=True))
+    if len(children) != 1:
+        return None
+    child = children[0]
+    if child.tag == "-text":
+        return child.text_content
+    if _is_element(child):
+        return _string(child)
+    return None
+
+def _matches(node, name, class_, text):
+    if node.tag != name:
+        return False
+    if class_ is not None:
+        classes = node.attributes.get("class") or ""
+        if class_ not in classes.split() and class_ != classes:
+            return False
+    if text is not None:
+        string = _string(node)
+        if string is None:
+            return False
+        if hasattr(text, "search"):
+            return text.search(string) is not None
+        return string == text
+    return True
+
+
+class LexborTag:
+    __slots__ = ("node", "document")
+
+    def __init__(self, node, document=False):
+        self.node = node
+        self.document = document
+
+    @property
+    def name(self):
+        return self.node.tag
+
+    @property
+    def text(self):
+        return "".join(node.text_content or "" for node in self.node.traverse(include_text=True) if node.tag == "-text")
+
+    def get(self, key, default=None):
+        return self.node.attributes.get(key, default)
+
+    def _descendants(self):
+        nodes = self.node.traverse()
+        if not self.document:
+            next(nodes)
+        return nodes
+
+    def find_all(self, name, class_=None, text=None):
+        return [LexborTag(node) for node in self._descendants() if _matches(node, name, class_, text)]
+
+    def find(self, name, class_=None, text=None):
+        for node in self._descendants():
+            if _matches(node, name, class_, text):
+                return LexborTag(node)
+        return None
+
+    def find_next_sibling(self):
+        node = self.node.next
+        while node is not None and not _is_element(node):
+            node = node.next
+        return LexborTag(node) if node is not None else None
+
+    def find_next(self, name):
+        root = self.node
+        while root.parent is not None:
+            root = root.parent
+        seen = False
+        for node in root.traverse():
+            if seen and node.tag == name:
+                return LexborTag(node)
+            if node.mem_id == self.node.mem_id:
+                seen = True
+        return None
@@ -3,16 +3,28 @@ Example usage:
 python3 -u scrape_updateparishdata.py --output data/updateparishdata --dry-run | tee data/updateparishdata/logs/dry.txt
 
 python3 -u scrape_updateparishdata.py --output data/updateparishdata/canada | tee data/updateparishdata/logs/canada.txt
+
+python3 -u scrape_updateparishdata.py --store snapshots --cities usa
+
+python3 -u scrape_updateparishdata.py --output data/updateparishdata --fetch-cache data/updateparishdata/fetch_cache.sqlite
 """
 import argparse
 from dataclasses import dataclass
 import json
 import os
-from geopy.geocoders import Nominatim
-from typing import Tuple
+from typing import Optional, Tuple
 import requests
 import datetime
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from coverage_planner import CoveragePlanner
+from fetch_cache import FetchCache
+import instrument
+from geocode import GeocodeCache
+from parallel import file_id
+from snapshot_store import SnapshotStore
 
 @dataclass
 class Request:
@@ -33,76 +45,229 @@ _NEW_ZEALAND_CITIES = ["Auckland, New Zealand", "Christchurch, New Zealand", "We
 _WIKI_CITIES = _UK_IRELAND_CITIES + _AUSTRALIA_CITIES + _NEW_ZEALAND_CITIES
 _REQUEST_INTERVAL = datetime.timedelta(seconds=5)
 
-def lat_lng(city: str) -> Tuple[float, float]:
-    geolocator = Nominatim(user_agent="my_app")
-    location = geolocator.geocode(city)
-    if location is None:
-        print(f"Failed to get location for {city}")
-        return (0.0,0.0)
-    return location.latitude, location.longitude
+_CITY_LISTS = {"usa": _WIKI_USA_CITIES, "canada": _CANADA_CITIES, "wiki": _WIKI_CITIES}
+
+def lat_lng(city: str, cache: Optional[GeocodeCache] = None) -> Tuple[float, float]:
+    if cache is None:
+        cache = GeocodeCache()
+    return cache.geocode(city)
+
+_API_URL = "https://apiv4.updateparishdata.org/Churchs/"
 
-def make_url(lat: float, lng: float, page: int) -> str:
-    return f"https://apiv4.updateparishdata.org/Churchs/?lat={lat}&long={lng}&pg={page}"
+def make_url(lat: float, lng: float, page: int, api_url: str = _API_URL) -> str:
+    return f"{api_url}?lat={lat}&long={lng}&pg={page}"
 
 def request_id(city, page):
     return f"{city.replace(' ', '_').replace(',', '-')}_page{page}.json"
 
-def check_disk(dir, city, page):
-    
-    return os.path.exists()
+def write_json_atomic(path, data):
+    """
+    Writes to a temp file and renames it, so an interrupted run never leaves a
+    truncated page that looks complete.
+    """
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Query updateparishdata to get church locations.")
-    parser.add_argument("--output", help="Path to the data output directory")
-    parser.add_argument("--dry-run", action="store_true", help="Perform a dry run")
-    args = parser.parse_args()
 
-    last_request_time = datetime.datetime.now() - datetime.timedelta(minutes=10)
+class RateLimiter:
+    """
+    Spaces requests at least interval apart, shared by all fetching threads.
+    """
+    def __init__(self, interval: datetime.timedelta):
+        self.interval = interval.total_seconds()
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            wait_seconds = self.next_time - time.monotonic()
+            self.next_time = max(self.next_time, time.monotonic()) + self.interval
+        if wait_seconds > 0:
+            print(f"Waiting {wait_seconds:.2f} seconds")
+            time.sleep(wait_seconds)
+
+
+class PageScheduler:
+    """
+    Fetches the pages of every city through one pooled session. Cities are
+    geocoded by a background thread ahead of the fetchers, and up to
+    concurrency cities are paged at the same time under the shared rate limit.
+    Pages are written to output_dir, or to the snapshot store when one is given.
+    With a fetch cache, pages fetched before are requested again conditionally
+    and only written when they changed, instead of being skipped.
+    """
+    def __init__(self, output_dir, geocode_cache, interval=_REQUEST_INTERVAL, concurrency=1, dry_run=False, api_url=_API_URL, planner=None, store=None, fetch_cache=None):
+        self.output_dir = output_dir
+        self.store = store
+        self.fetch_cache = fetch_cache
+        self.geocode_cache = geocode_cache
+        self.rate_limiter = RateLimiter(interval)
+        self.concurrency = concurrency
+        self.dry_run = dry_run
+        self.api_url = api_url
+        self.planner = planner
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pages_written = 0
+        self.pages_unchanged = 0
+
+    def _page_done(self, city, page):
+        if self.store is not None:
+            return self.store.has("updateparishdata", file_id(request_id(city, page)))
+        return os.path.exists(os.path.join(self.output_dir, request_id(city, page)))
+
+    def _save_page(self, city, page, data):
+        if self.store is not None:
+            self.store.put("updateparishdata", file_id(request_id(city, page)), json.dumps(data).encode("utf-8"))
+            self.store.flush()
+        else:
+            write_json_atomic(os.path.join(self.output_dir, request_id(city, page)), data)
+
+    def _load_page(self, city, page):
+        if self.store is not None:
+            return json.loads(self.store.read("updateparishdata", file_id(request_id(city, page))))
+        with open(os.path.join(self.output_dir, request_id(city, page)), "r") as f:
+            return json.load(f)
+
+    def fetch_city(self, city, lat, lng):
+        if self.planner is not None and self.planner.should_skip(city, lat, lng):
+            return
+        try:
+            self._fetch_pages(city, lat, lng)
+        finally:
+            if self.planner is not None:
+                self.planner.finish(city)
 
-    for city in _WIKI_CITIES[::-1]:
+    def _fetch_pages(self, city, lat, lng):
         page = 1
-        response_filename = os.path.join(args.output, request_id(city, page))
-        if os.path.exists(response_filename):
-            print(f"Skipping already done {city} {page}")
-            continue
-
-        lat, lng = lat_lng(city)
-        if not lat or not lng:
-            print(f"Failed to get lat/lng for {city}")
-            continue
-        
-        
         while page:
-            response_filename = os.path.join(args.output, request_id(city, page))
-            if os.path.exists(response_filename):
+            done = self._page_done(city, page)
+            if done and self.fetch_cache is None:
                 print(f"Skipping already done {city} {page}")
-                page += 1
-                # continue
                 break
-            
-            wait_seconds = last_request_time - datetime.datetime.now() + _REQUEST_INTERVAL
-            if wait_seconds.total_seconds() > 0:
-                print(f"Waiting {wait_seconds.total_seconds()} seconds")
-                time.sleep(wait_seconds.total_seconds())
 
-            url = make_url(lat, lng, page)
+            self.rate_limiter.wait()
+            url = make_url(lat, lng, page, self.api_url)
             print(f"Requesting {city} {page}: {url}")
-            last_request_time = datetime.datetime.now()
 
-            if args.dry_run:
+            if self.dry_run:
                 print(f"DRY RUN skipping request to {url}")
                 break
-            
-            response = requests.get(url)
-            if response.status_code != 200:
+
+            headers = self.fetch_cache.headers(url) if done else {}
+            try:
+                with instrument.stage("scrape.request", url):
+                    response = self.session.get(url, headers=headers, timeout=60)
+            except requests.RequestException as e:
+                instrument.count("scrape.failures")
+                print(f"Failed to get request for {city} {page}: {e}")
+                break
+            if response.status_code == 304:
+                self.fetch_cache.not_modified(url)
+                print(f"Unchanged {city} {page}")
+                self.pages_unchanged += 1
+                instrument.count("scrape.unchanged")
+                data = self._load_page(city, page)
+            elif response.status_code != 200:
+                instrument.count("scrape.failures")
                 print(f"Failed to get request for {city} {page}")
                 break
-            data = response.json()
-            if not data:
-                print(f"Empty data for {city} {page}")
-                page = 0
+            else:
+                data = response.json()
+                if not data:
+                    instrument.count("scrape.empty_pages")
+                    print(f"Empty data for {city} {page}")
+                    break
+                if self.fetch_cache is not None and not self.fetch_cache.record(url, response.headers, response.content) and done:
+                    print(f"Unchanged {city} {page}")
+                    self.pages_unchanged += 1
+                    instrument.count("scrape.unchanged")
+                else:
+                    self._save_page(city, page, data)
+                    self.pages_written += 1
+                    instrument.count("scrape.pages")
+                    instrument.count("scrape.records", len(data))
+            if self.planner is not None and self.planner.observe_page(city, lat, lng, data):
                 break
-            with open(response_filename, "w") as f:
-                json.dump(data, f)
-            
             page += 1
+
+    def run(self, cities):
+        if self.fetch_cache is None:
+            cities = [city for city in cities if not self._skip(city)]
+        with ThreadPoolExecutor(max_workers=1) as geocoder, ThreadPoolExecutor(max_workers=self.concurrency) as fetchers:
+            # geocoding runs one city at a time in order, so the cache only has one writer
+            coordinates = [geocoder.submit(self._geocode, city) for city in cities]
+            fetches = []
+            for city, future in zip(cities, coordinates):
+                lat, lng = future.result()
+                if not lat or not lng:
+                    print(f"Failed to get lat/lng for {city}")
+                    continue
+                fetches.append(fetchers.submit(self.fetch_city, city, lat, lng))
+            for fetch in fetches:
+                fetch.result()
+        self.geocode_cache.save()
+
+    def _geocode(self, city):
+        # resolve_all saves the cache after a live geocode
+        return self.geocode_cache.resolve_all([city])[city]
+
+    def _skip(self, city):
+        if self._page_done(city, 1):
+            print(f"Skipping already done {city} 1")
+            if self.planner is not None:
+                self._seed_planner(city)
+            return True
+        return False
+
+    def _seed_planner(self, city):
+        coordinates = self.geocode_cache.lookup(city)
+        if coordinates is None:
+            return
+        pages = []
+        page = 1
+        while self._page_done(city, page):
+            pages.append(self._load_page(city, page))
+            page += 1
+        self.planner.seed(city, *coordinates, pages)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query updateparishdata to get church locations.")
+    parser.add_argument("--output", help="Path to the data output directory")
+    parser.add_argument("--store", help="Path to a snapshot store to write the pages to instead of the output directory")
+    parser.add_argument("--fetch-cache", help="Path to a SQLite file of page validators, pages fetched before are then revalidated instead of skipped")
+    parser.add_argument("--dry-run", action="store_true", help="Perform a dry run")
+    parser.add_argument("--cities", choices=sorted(_CITY_LISTS), default="wiki", help="Which list of cities to query")
+    parser.add_argument("--geocode-cache", help="Path to the geocode cache, defaults to geocode_cache.json in the output directory")
+    parser.add_argument("--geocode-ttl-days", type=float, default=180, help="Days before a cached geocode is looked up again")
+    parser.add_argument("--pre-resolve", action="store_true", help="Geocode every known city into the cache, then exit")
+    parser.add_argument("--interval", type=float, default=_REQUEST_INTERVAL.total_seconds(), help="Minimum seconds between requests to the API")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of cities paged at the same time")
+    parser.add_argument("--api-url", default=_API_URL, help="Base URL of the churches API")
+    parser.add_argument("--plan-coverage", action="store_true", help="Skip or stop city queries whose area earlier queries already covered")
+    parser.add_argument("--coverage-radius-km", type=float, help="Reach expected from a new city query, defaults to the median of finished ones")
+    parser.add_argument("--coverage-stop-after", type=int, default=2, help="Pages of only known churches before a covered query is stopped")
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.enable_from_args(args)
+
+    store = SnapshotStore(args.store, create=True) if args.store else None
+    geocode_cache = GeocodeCache(args.geocode_cache or os.path.join(args.output or args.store, "geocode_cache.json"), args.geocode_ttl_days)
+    if args.pre_resolve:
+        geocode_cache.resolve_all(_WIKI_USA_CITIES + _CANADA_CITIES + _WIKI_CITIES)
+        print(f"Geocode cache has {len(geocode_cache.entries)} cities, made {geocode_cache.calls} geocoder calls")
+        exit(0)
+
+    planner = CoveragePlanner(args.coverage_radius_km, args.coverage_stop_after) if args.plan_coverage else None
+    fetch_cache = FetchCache(args.fetch_cache) if args.fetch_cache else None
+    scheduler = PageScheduler(args.output, geocode_cache, datetime.timedelta(seconds=args.interval), args.concurrency, args.dry_run, args.api_url, planner, store, fetch_cache)
+    scheduler.run(_CITY_LISTS[args.cities][::-1])
+    if store is not None:
+        store.close()
+    print(f"Wrote {scheduler.pages_written} pages, {scheduler.pages_unchanged} unchanged, with {geocode_cache.calls} geocoder calls")
+    if planner is not None:
+        planner.report()
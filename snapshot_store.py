@@ -0,0 +1,258 @@
+"""
+Snapshot store for scraped pages, instead of one loose file per page.
+
+Page bodies are compressed with zstd (zlib when zstandard is not installed) and
+appended to a few large pack files. A SQLite index maps (source, identifier,
+fetched_at) to the content hash of the body, and every distinct body is stored
+only once, so refetching an unchanged page costs one index row. Bodies are read
+through memory maps of the pack files.
+
+A store has one writer at a time. Readers can be any number of processes.
+
+Example usage:
+python3 snapshot_store.py import snapshots cpe "cpe_data/*.html"
+python3 snapshot_store.py import snapshots updateparishdata "data/updateparishdata/*.json"
+python3 snapshot_store.py stats snapshots
+"""
+import argparse
+import datetime
+import fnmatch
+import hashlib
+import io
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from inputs import get_filenames
+from parallel import file_id, sort_by_id
+
+_PACK_SIZE = 1 << 30
+_ZSTD_LEVEL = 3
+
+
+def _compress(data):
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(data)
+    return "zlib", zlib.compress(data)
+
+def _decompress(codec, data):
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if zstandard is None:
+        raise ImportError("zstandard is needed to read zstd compressed snapshots")
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+class SnapshotStore:
+    """
+    Args:
+        path: Directory of the store.
+        create: Create the store if missing, for the commands that write to it.
+            Readers raise instead, so a mistyped path is not read as an empty store.
+    """
+    def __init__(self, path, create=False):
+        self.path = path
+        if create:
+            os.makedirs(path, exist_ok=True)
+        elif not os.path.exists(os.path.join(path, "index.sqlite")):
+            raise ValueError(f"No snapshot store at {path}")
+        self.lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._maps = {}
+        self._pack = None
+        self._pack_number = None
+        self.written = 0
+        self.deduplicated = 0
+
+    def _db(self):
+        # sqlite connections can not be shared with forked worker processes
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(os.path.join(self.path, "index.sqlite"), timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS blobs (sha1 TEXT PRIMARY KEY, pack INTEGER, offset INTEGER, length INTEGER, size INTEGER, codec TEXT)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS snapshots (source TEXT, identifier TEXT, fetched_at REAL, sha1 TEXT, PRIMARY KEY (source, identifier, fetched_at)) WITHOUT ROWID")
+            self._pid = os.getpid()
+            self._maps = {}
+        return self._connection
+
+    def _pack_path(self, number):
+        return os.path.join(self.path, f"pack-{number:06d}.pack")
+
+    def _open_pack(self, size):
+        if self._pack is None:
+            self._pack_number = self._db().execute("SELECT COALESCE(MAX(pack), 0) FROM blobs").fetchone()[0]
+            self._pack = open(self._pack_path(self._pack_number), "ab")
+        if self._pack.tell() + size > _PACK_SIZE and self._pack.tell() > 0:
+            self._pack.close()
+            self._pack_number += 1
+            self._pack = open(self._pack_path(self._pack_number), "ab")
+        return self._pack
+
+    def put(self, source, identifier, data, fetched_at=None):
+        """
+        Adds a snapshot of a page body, visible to readers after flush().
+        """
+        if fetched_at is None:
+            fetched_at = time.time()
+        digest = hashlib.sha1(data).hexdigest()
+        with self.lock:
+            db = self._db()
+            if db.execute("SELECT 1 FROM blobs WHERE sha1 = ?", (digest,)).fetchone() is None:
+                codec, compressed = _compress(data)
+                pack = self._open_pack(len(compressed))
+                offset = pack.tell()
+                pack.write(compressed)
+                db.execute("INSERT INTO blobs VALUES (?, ?, ?, ?, ?, ?)", (digest, self._pack_number, offset, len(compressed), len(data), codec))
+                self.written += 1
+            else:
+                self.deduplicated += 1
+            db.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)", (source, identifier, fetched_at, digest))
+
+    def flush(self):
+        with self.lock:
+            if self._pack is not None:
+                self._pack.flush()
+            self._db().commit()
+
+    def has(self, source, identifier):
+        with self.lock:
+            return self._db().execute("SELECT 1 FROM snapshots WHERE source = ? AND identifier = ? LIMIT 1", (source, identifier)).fetchone() is not None
+
+    def identifiers(self, source, pattern="*", as_of=None):
+        """
+        Identifiers of source matching the glob pattern that have a snapshot
+        fetched at or before as_of, ordered like parallel.sort_by_id.
+        """
+        as_of = time.time() if as_of is None else as_of
+        with self.lock:
+            rows = self._db().execute("SELECT DISTINCT identifier FROM snapshots WHERE source = ? AND fetched_at <= ?", (source, as_of)).fetchall()
+        return sort_by_id(identifier for identifier, in rows if fnmatch.fnmatchcase(identifier, pattern))
+
+    def digest(self, source, identifier, as_of=None):
+        """
+        Content hash of the latest snapshot of a page fetched at or before as_of.
+        """
+        as_of = time.time() if as_of is None else as_of
+        with self.lock:
+            row = self._db().execute(
+                "SELECT sha1 FROM snapshots WHERE source = ? AND identifier = ? AND fetched_at <= ? ORDER BY fetched_at DESC LIMIT 1",
+                (source, identifier, as_of)).fetchone()
+        if row is None:
+            raise KeyError(f"No snapshot of {source} {identifier}")
+        return row[0]
+
+    def _view(self, pack, end):
+        view = self._maps.get(pack)
+        if view is None or len(view) < end:
+            # the pack grew since it was mapped
+            with open(self._pack_path(pack), "rb") as f:
+                view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[pack] = view
+        return view
+
+    def read(self, source, identifier, as_of=None):
+        """
+        Body of the latest snapshot of a page fetched at or before as_of.
+        """
+        as_of = time.time() if as_of is None else as_of
+        with self.lock:
+            row = self._db().execute(
+                "SELECT b.pack, b.offset, b.length, b.codec FROM snapshots s JOIN blobs b ON b.sha1 = s.sha1"
+                " WHERE s.source = ? AND s.identifier = ? AND s.fetched_at <= ? ORDER BY s.fetched_at DESC LIMIT 1",
+                (source, identifier, as_of)).fetchone()
+            if row is None:
+                raise KeyError(f"No snapshot of {source} {identifier}")
+            pack, offset, length, codec = row
+            if self._pack is not None and pack == self._pack_number:
+                self._pack.flush()
+            view = self._view(pack, offset + length)
+            return _decompress(codec, view[offset:offset + length])
+
+    def open(self, source, identifier, as_of=None):
+        return io.BytesIO(self.read(source, identifier, as_of))
+
+    def stats(self):
+        with self.lock:
+            db = self._db()
+            sources = db.execute("SELECT source, COUNT(DISTINCT identifier), COUNT(*) FROM snapshots GROUP BY source ORDER BY source").fetchall()
+            blobs, size, stored = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(length), 0) FROM blobs").fetchone()
+        return sources, blobs, size, stored
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self._pack is not None:
+                self._pack.close()
+                self._pack = None
+            for view in self._maps.values():
+                view.close()
+            self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def timestamp(text):
+    """
+    argparse type for --as-of, an ISO date or date and time.
+    """
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+_stores = {}
+
+def read_snapshot(store_path, source, identifier, as_of=None):
+    """
+    read() through a store kept open per process, for module level functions
+    run by parallel.map_files.
+    """
+    key = (store_path, os.getpid())
+    if key not in _stores:
+        _stores[key] = SnapshotStore(store_path)
+    return _stores[key].read(source, identifier, as_of)
+
+def import_files(store, source, file_pattern):
+    """
+    Adds every file matching file_pattern as a snapshot fetched at its mtime,
+    under its file ID.
+    """
+    filenames = get_filenames(file_pattern)
+    for i, filename in enumerate(sort_by_id(filenames)):
+        with open(filename, "rb") as f:
+            data = f.read()
+        store.put(source, file_id(filename), data, os.stat(filename).st_mtime)
+        if i % 1000 == 999:
+            store.flush()
+    store.flush()
+    return len(filenames)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage a snapshot store of scraped pages.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import a directory of scraped pages")
+    import_parser.add_argument("store", help="Path to the store directory")
+    import_parser.add_argument("source", help="Source the pages belong to, like cpe, acpe or updateparishdata")
+    import_parser.add_argument("files", help="Glob of the page files")
+    stats_parser = subparsers.add_parser("stats", help="Print what the store holds")
+    stats_parser.add_argument("store", help="Path to the store directory")
+    args = parser.parse_args()
+
+    with SnapshotStore(args.store, create=args.command == "import") as store:
+        if args.command == "import":
+            count = import_files(store, args.source, args.files)
+            print(f"Imported {count} files, {store.written} new bodies, {store.deduplicated} already stored")
+        else:
+            sources, blobs, size, stored = store.stats()
+            for source, identifiers, snapshots in sources:
+                print(f"{source}: {identifiers} pages, {snapshots} snapshots")
+            print(f"{blobs} distinct bodies, {size} bytes compressed to {stored} ({stored / max(1, size):.1%})")
@@ -0,0 +1,266 @@
+"""
+Spatial index over the churches of the updateparishdata output, for radius and
+nearest neighbour joins with the CPE programs.
+
+Points are bucketed in a grid of cells about cell_km high, kept sorted by cell
+so a row of cells is one slice of the index. Queries are grouped by the cell
+they fall in, and every group is measured against the points of the cells in
+reach all at once, with haversine distances computed by numpy.
+
+Program addresses are looked up in a GeocodeCache, by address and then by city.
+Only with --geocode are the missing ones sent to Nominatim, so the first run
+over a large spreadsheet is slow and later ones are not.
+
+Example usage:
+python3 spatial.py churches.tsv cpe.tsv cpe_churches.tsv --radius 25 --geocode-cache addresses.json --geocode
+python3 spatial.py churches.sqlite cpe.tsv cpe_churches.tsv --db --nearest 3 --geocode-cache addresses.json
+"""
+import argparse
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from church_store import ChurchStore
+from geocode import GeocodeCache
+from output import FORMATS, open_tsv, open_writer
+
+_EARTH_RADIUS_KM = 6371.0088
+_KM_PER_DEGREE = _EARTH_RADIUS_KM * math.pi / 180
+# queries measured in one distance matrix
+_GROUP_SIZE = 1024
+
+
+def haversine_km(lats1, lngs1, lats2, lngs2):
+    """
+    Distances from every point of the first arrays to every point of the
+    second, in radians, as a len(lats1) x len(lats2) matrix.
+    """
+    a = (np.sin((lats2[None, :] - lats1[:, None]) / 2) ** 2
+         + np.cos(lats1)[:, None] * np.cos(lats2)[None, :] * np.sin((lngs2[None, :] - lngs1[:, None]) / 2) ** 2)
+    return 2 * _EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+
+
+class SpatialIndex:
+    """
+    Args:
+        lats, lngs: Coordinates of the points in degrees.
+        cell_km: Height of the grid cells, about the radius of the usual query.
+    """
+    def __init__(self, lats, lngs, cell_km=25.0):
+        if np is None:
+            raise ImportError("numpy is needed for the spatial index")
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        self.size = len(lats)
+        self.cell_km = cell_km
+        self.lat_step = cell_km / _KM_PER_DEGREE
+        self.nrows = math.ceil(180 / self.lat_step)
+        # a whole number of columns, so they wrap around at the antimeridian
+        self.ncols = math.ceil(360 / self.lat_step)
+        self.lng_step = 360 / self.ncols
+        keys = self._keys(lats, lngs)
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        self.lats = np.radians(lats[self.order])
+        self.lngs = np.radians(lngs[self.order])
+
+    def _keys(self, lats, lngs):
+        rows = np.clip(np.floor((lats + 90) / self.lat_step).astype(np.int64), 0, self.nrows - 1)
+        cols = np.floor((lngs + 180) / self.lng_step).astype(np.int64) % self.ncols
+        return rows * self.ncols + cols
+
+    def _groups(self, lats, lngs):
+        # (cell key, positions of the queries in that cell)
+        keys = self._keys(lats, lngs)
+        order = np.argsort(keys, kind="stable")
+        starts = np.flatnonzero(np.diff(keys[order], prepend=-1))
+        for start, end in zip(starts, np.append(starts[1:], len(order))):
+            for chunk in range(start, end, _GROUP_SIZE):
+                yield keys[order[start]], order[chunk:min(end, chunk + _GROUP_SIZE)]
+
+    def _candidates(self, key, radius_km):
+        """
+        Positions of the points that may lie within radius_km of some point of
+        the cell key.
+        """
+        row, col = divmod(int(key), self.ncols)
+        delta = radius_km / _EARTH_RADIUS_KM
+        lat_lo = row * self.lat_step - 90
+        lat_hi = lat_lo + self.lat_step
+        row_lo = max(0, math.floor((lat_lo - math.degrees(delta) + 90) / self.lat_step))
+        row_hi = min(self.nrows - 1, math.floor((lat_hi + math.degrees(delta) + 90) / self.lat_step))
+        max_lat = math.radians(max(abs(lat_lo), abs(lat_hi)))
+        if max_lat + delta >= math.pi / 2:
+            # a pole is in reach, so is every longitude
+            spans = [(row_lo * self.ncols, (row_hi + 1) * self.ncols)]
+        else:
+            reach = math.degrees(math.asin(math.sin(delta) / math.cos(max_lat)))
+            lng_lo = col * self.lng_step - 180
+            col_lo = math.floor((lng_lo - reach + 180) / self.lng_step)
+            col_hi = math.floor((lng_lo + self.lng_step + reach + 180) / self.lng_step)
+            if col_hi - col_lo + 1 >= self.ncols:
+                col_spans = [(0, self.ncols - 1)]
+            elif col_lo < 0:
+                col_spans = [(col_lo + self.ncols, self.ncols - 1), (0, col_hi)]
+            elif col_hi >= self.ncols:
+                col_spans = [(col_lo, self.ncols - 1), (0, col_hi - self.ncols)]
+            else:
+                col_spans = [(col_lo, col_hi)]
+            spans = [(row * self.ncols + first, row * self.ncols + last + 1) for row in range(row_lo, row_hi + 1) for first, last in col_spans]
+        bounds = np.searchsorted(self.keys, np.array(spans).ravel()).reshape(-1, 2)
+        return np.concatenate([np.arange(start, end) for start, end in bounds])
+
+    def within(self, lats, lngs, radius_km):
+        """
+        Points within radius_km of every query point, as a list with an
+        (indices, distances) pair of arrays per query, nearest first.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        query_lats, query_lngs = np.radians(lats), np.radians(lngs)
+        results = [None] * len(lats)
+        for key, queries in self._groups(lats, lngs):
+            candidates = self._candidates(key, radius_km)
+            distances = haversine_km(query_lats[queries], query_lngs[queries], self.lats[candidates], self.lngs[candidates])
+            for query, row in zip(queries, distances):
+                inside = np.flatnonzero(row <= radius_km)
+                inside = inside[np.argsort(row[inside], kind="stable")]
+                results[query] = (self.order[candidates[inside]], row[inside])
+        return results
+
+    def nearest(self, lats, lngs, k):
+        """
+        The k nearest points of every query point, as (indices, distances)
+        arrays of shape (queries, k), nearest first. Rows are padded with -1
+        and inf when the index has fewer than k points.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        query_lats, query_lngs = np.radians(lats), np.radians(lngs)
+        indices = np.full((len(lats), k), -1, dtype=np.int64)
+        distances = np.full((len(lats), k), np.inf)
+        found = min(k, self.size)
+        if found == 0:
+            return indices, distances
+        for key, queries in self._groups(lats, lngs):
+            radius_km = self.cell_km
+            while len(queries):
+                candidates = self._candidates(key, radius_km)
+                matrix = haversine_km(query_lats[queries], query_lngs[queries], self.lats[candidates], self.lngs[candidates])
+                # the k nearest are known once k points lie within the radius searched
+                done = np.count_nonzero(matrix <= radius_km, axis=1) >= found
+                if radius_km >= math.pi * _EARTH_RADIUS_KM:
+                    done[:] = True
+                if done.any():
+                    nearest = np.argsort(matrix[done], axis=1, kind="stable")[:, :found]
+                    indices[queries[done], :found] = self.order[candidates[nearest]]
+                    distances[queries[done], :found] = np.take_along_axis(matrix[done], nearest, axis=1)
+                queries = queries[~done]
+                radius_km *= 2
+        return indices, distances
+
+def _read_tsv(path):
+    with open_tsv(path) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        return header, [line.rstrip("\n").split("\t") for line in f]
+
+def load_churches(path, db=False):
+    """
+    Header, rows and coordinates of the churches that have coordinates, from
+    the output of make_updateparishdata_spreadsheet.py or from a church store.
+    """
+    if db:
+        with ChurchStore(path) as store:
+            header = [name for name, _ in store.columns]
+            rows = [[str(value) for value in row] for row in store.query()]
+    else:
+        header, rows = _read_tsv(path)
+    lat_index, lng_index = header.index("lat"), header.index("lng")
+    churches, lats, lngs = [], [], []
+    for row in rows:
+        try:
+            lat, lng = float(row[lat_index]), float(row[lng_index])
+        except ValueError:
+            continue
+        # churches without coordinates have 0.0 for both
+        if lat or lng:
+            churches.append(row)
+            lats.append(lat)
+            lngs.append(lng)
+    return header, churches, lats, lngs
+
+def locate_programs(header, rows, cache, geocode=False):
+    """
+    Coordinates of every program row by its address, or by its city when the
+    address can not be found, None if neither is known. Only with geocode are
+    addresses missing from the cache looked up.
+    """
+    address_index, city_index, state_index = header.index("Address"), header.index("City"), header.index("State/Province Code")
+    known = {}
+    locations = []
+    for row in rows:
+        queries = (row[address_index], f"{row[city_index]}, {row[state_index]}")
+        if queries not in known:
+            known[queries] = None
+            for query in queries:
+                if not query.strip(", "):
+                    continue
+                location = cache.lookup(query)
+                if location is None and geocode:
+                    location = cache.resolve_all([query])[query]
+                # places the geocoder could not find are cached as (0.0, 0.0)
+                if location is not None and location != (0.0, 0.0):
+                    known[queries] = location
+                    break
+        locations.append(known[queries])
+    return locations
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Join the CPE programs to the churches near them.")
+    parser.add_argument("churches", help="Path to the output of make_updateparishdata_spreadsheet.py, or to a church store with --db")
+    parser.add_argument("programs", help="Path to the output of make_cpe_spreadsheet.py")
+    parser.add_argument("output", help="Path to the output file")
+    parser.add_argument("--db", action="store_true", help="Read the churches from a church store")
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument("-r", "--radius", type=float, help="Join every program to the churches within this many km")
+    query.add_argument("-n", "--nearest", type=int, help="Join every program to this many nearest churches")
+    parser.add_argument("--cell-km", type=float, default=25.0, help="Height of the grid cells of the index")
+    parser.add_argument("--geocode-cache", help="Path to a JSON file caching the coordinates of the program addresses")
+    parser.add_argument("--geocode", action="store_true", help="Geocode the program addresses missing from the cache with Nominatim, one per second")
+    parser.add_argument("--geocode-ttl-days", type=float, default=180, help="Days before a cached geocode is looked up again")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="tsv", help="Output format, parquet and arrow need pyarrow")
+    parser.add_argument("-z", "--gzip", action="store_true", help="Compress the output with gzip, also done for paths ending in .gz")
+    args = parser.parse_args()
+
+    church_header, churches, church_lats, church_lngs = load_churches(args.churches, args.db)
+    index = SpatialIndex(church_lats, church_lngs, args.cell_km)
+    print(f"Indexed {index.size} churches with coordinates")
+
+    program_header, programs = _read_tsv(args.programs)
+    cache = GeocodeCache(args.geocode_cache, args.geocode_ttl_days)
+    locations = locate_programs(program_header, programs, cache, args.geocode)
+    located = [i for i, location in enumerate(locations) if location is not None]
+    print(f"Found coordinates of {len(located)} of {len(programs)} programs")
+    lats = [locations[i][0] for i in located]
+    lngs = [locations[i][1] for i in located]
+
+    if args.radius is not None:
+        matches = index.within(lats, lngs, args.radius)
+    else:
+        indices, distances = index.nearest(lats, lngs, args.nearest)
+        matches = [(row_indices[row_indices >= 0], row_distances[row_indices >= 0]) for row_indices, row_distances in zip(indices, distances)]
+
+    columns = [(name, str) for name in program_header] + [("Latitude", float), ("Longitude", float)]
+    columns += [(f"church_{name}", str) for name in church_header] + [("Distance (km)", float)]
+    joined = 0
+    with open_writer(args.output, columns, args.format, args.gzip) as writer:
+        for i, (church_indices, church_distances) in zip(located, matches):
+            lat, lng = locations[i]
+            joined += bool(len(church_indices))
+            for church, distance in zip(church_indices, church_distances):
+                writer.write(programs[i] + [lat, lng] + churches[church] + [round(float(distance), 3)])
+    print(f"Joined {joined} programs to churches")
+    print(f"{args.format.upper()} file created: {args.output} with {writer.rows} rows.")
@@ -0,0 +1,73 @@
+import collections
+import hashlib
+import http.server
+import os
+import sys
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+# the modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    /page/<id> serves the body set for <id>, /fail/<n>/<id> answers 500 to
+    the first n requests for it. /etag/<id> also sends validators and answers
+    304 to a matching If-None-Match, like /api/?pg=<n> for the JSON body set
+    for page<n>.
+    """
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests[self.path] += 1
+            count = server.requests[self.path]
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        if parts[0] == "fail" and count <= int(parts[1]):
+            self.send_error(500)
+            return
+        if parts[0] == "api":
+            name = f"page{parse_qs(url.query)['pg'][0]}"
+            body = server.bodies.get(name, "[]").encode("utf-8")
+        else:
+            body = server.bodies.get(parts[-1], f"<html><body>{parts[-1]}</body></html>").encode("utf-8")
+        headers = {"Content-Length": str(len(body))}
+        if parts[0] in ("etag", "api"):
+            headers["ETag"] = f'"{hashlib.sha1(body).hexdigest()}"'
+            headers["Last-Modified"] = "Mon, 01 Jan 2024 00:00:00 GMT"
+            if self.headers.get("If-None-Match") == headers["ETag"]:
+                with server.lock:
+                    server.not_modified += 1
+                self.send_response(304)
+                self.end_headers()
+                return
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stand_in_server():
+    """
+    Local HTTP server standing in for the scraped sites, on a free port.
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    server.lock = threading.Lock()
+    server.requests = collections.Counter()
+    server.bodies = {}
+    server.not_modified = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,116 @@
+"""
+The batch phone, name and email normalization against the scalar versions it replaced.
+"""
+import random
+import re
+
+import pytest
+
+from models import Contact, break_full_names, emails_to_people, parse_phones
+
+
+def _reference_break_full_name(full_identity):
+    if not full_identity:
+        return "", "", ""
+    identifiers = full_identity.split(",")
+    full_name, *degrees = identifiers
+    names = full_name.split()
+    names = [name.capitalize() if name.islower() or name.isupper() else name for name in names]
+    if len(names) == 1:
+        return names[0], "", ""
+    elif len(names) == 2:
+        return names[0], "", names[1]
+    else:
+        return names[0], " ".join(names[1:-1]), names[-1]
+
+def _reference_phone(s):
+    digits = re.findall(r'\d', s)
+    if len(digits) < 10:
+        return "", ""
+    if len(digits) == 10 or len(digits) == 11:
+        return "".join(digits), ""
+    all_digits = "".join(digits)
+    return all_digits[:10], all_digits[10:]
+
+def _reference_person(names):
+    names = [re.sub(r'[^a-zA-Z-]', '', name.capitalize()) for name in names]
+    if len(names) == 1:
+        return names[0], "", ""
+    elif len(names) == 2:
+        return names[0], "", names[1]
+    else:
+        return names[0], names[1], names[2]
+
+def _reference_email_to_person(email):
+    if not email:
+        return None
+    address = email.split("@")[0]
+    for separator in (".", "_"):
+        if separator in address:
+            parts = address.split(separator)
+            return None if len(parts) > 3 else _reference_person(parts)
+    return None
+
+def _reference_contact(text_list):
+    first, middle, last = _reference_break_full_name(text_list[0])
+    phone, phone_ext = _reference_phone(text_list[2]) if len(text_list) > 2 else ("", "")
+    return first, middle, last, text_list[1], phone, phone_ext
+
+def _person(person):
+    return None if person is None else (person.first, person.middle, person.last)
+
+def _contact(contact):
+    return contact.first_name, contact.middle_name, contact.last_name, contact.email, contact.phone, contact.phone_ext
+
+_WORDS = ["john", "MARY", "Ann", "McDonald", "o'brien", "Jean-Luc", "Évariste", "de la", "VAN", "x", "Ph.D.", "BCC", "MDiv"]
+
+def _phones(rng, count):
+    pieces = ["(", ")", "-", " ", ".", "+1", "ext", "x", "#", "Ext. ", "tel:", "½", "٣"]
+    for _ in range(count):
+        yield "".join(rng.choice([str(rng.randint(0, 9))] * 4 + pieces) for _ in range(rng.randint(0, 24)))
+
+def _full_names(rng, count):
+    for _ in range(count):
+        name = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 5)))
+        degrees = [rng.choice(_WORDS) for _ in range(rng.randint(0, 2))]
+        yield ", ".join([name] + degrees)
+
+def _emails(rng, count):
+    for _ in range(count):
+        separator = rng.choice([".", "_", "", "-"])
+        address = separator.join(rng.choice(_WORDS).replace(" ", "") for _ in range(rng.randint(1, 5)))
+        yield rng.choice([address, f"{address}@example.org", f"{address}@a.b.org", ""])
+
+def test_phones():
+    texts = list(_phones(random.Random(0), 50000))
+    texts += ["(212) 555-0100", "212.555.0100 ext 12", "1-212-555-0100", "12125550100x7", "555-0100", ""]
+    assert parse_phones(texts) == [_reference_phone(text) for text in texts]
+
+def test_full_names():
+    names = list(_full_names(random.Random(1), 50000)) + ["", "Cher", "john smith, BCC", "MARY ANN LEE JONES, MDiv, PhD"]
+    assert break_full_names(names) == [_reference_break_full_name(name) for name in names]
+
+@pytest.mark.parametrize("name", [" ", ", BCC", "\t"])
+def test_blank_full_names(name):
+    # the scalar version fails on names with nothing before the degrees, so does the batch one
+    with pytest.raises(IndexError):
+        _reference_break_full_name(name)
+    with pytest.raises(IndexError):
+        break_full_names(["John Smith", name])
+
+def test_emails():
+    emails = list(_emails(random.Random(2), 50000)) + ["", "info@example.org", "a.b.c.d@example.org", "first_last@example.org"]
+    people = emails_to_people(emails)
+    assert [_person(person) for person in people] == [_reference_email_to_person(email) for email in emails]
+
+def test_equal_emails_share_a_person():
+    first, second = emails_to_people(["john.smith@example.org", "john.smith@example.org"])
+    assert first is second
+
+def test_contact_rows():
+    rng = random.Random(3)
+    rows = []
+    for name, email, phone in zip(_full_names(rng, 20000), _emails(rng, 20000), _phones(rng, 20000)):
+        rows.append(rng.choice([[name, email], [name, email, phone], [name, email, phone, "extra"]]))
+    assert [_contact(contact) for contact in Contact.from_rows(rows)] == [_reference_contact(row) for row in rows]
+    assert [_contact(contact) for contact in Contact.from_rows(rows)] == [_contact(Contact(row)) for row in rows]
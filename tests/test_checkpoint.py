@@ -0,0 +1,71 @@
+import json
+
+from checkpoint import Checkpoint
+from make_updateparishdata_spreadsheet import ChurchDeduper, Church, stream_churches
+from output import Quarantine, open_writer
+
+
+def _pages(tmp_path, count):
+    filenames = []
+    for i in range(count):
+        records = [{"id": i * 10 + k, "name": f"St. Mary {i}{k} - Parish", "last_update": "2024-01-01"} for k in range(3)]
+        if i % 2:
+            records.append({"id": i * 10 + 9, "name": "Unknown keys", "bogus": 1})
+        path = tmp_path / f"City{i}_page1.json"
+        path.write_text(json.dumps(records))
+        filenames.append(str(path))
+    return filenames
+
+def _build(filenames, output, checkpoint, stop_after=None):
+    """
+    The updateparishdata build loop, saving a checkpoint after every file.
+    With stop_after it stops like a crash, after writing part of the next file.
+    """
+    todo, state = checkpoint.resume(filenames)
+    files_done = len(filenames) - len(todo)
+    deduper = ChurchDeduper() if state is None else state["deduper"]
+    quarantine = Quarantine(f"{output}.quarantine.jsonl", state and state["quarantine_size"])
+    with open_writer(output, Church.columns(), resume_at=state and state["output_size"]) as writer, quarantine:
+        if state is not None:
+            writer.rows = state["rows"]
+            quarantine.count = state["quarantined"]
+        for filename, churches in stream_churches(todo, deduper, quarantine):
+            for i, (city, church) in enumerate(churches):
+                if files_done == stop_after and i == 1:
+                    return
+                church = deduper.add(church, city)
+                if church is not None:
+                    writer.write(church.values())
+            files_done += 1
+            checkpoint.save(files_done, filename, {"output_size": writer.tell(), "rows": writer.rows, "quarantine_size": quarantine.tell(), "quarantined": quarantine.count, "deduper": deduper})
+    checkpoint.remove()
+
+def test_resume_matches_a_straight_run(tmp_path):
+    filenames = _pages(tmp_path, 6)
+    _build(filenames, str(tmp_path / "straight.tsv"), Checkpoint(str(tmp_path / "straight.checkpoint"), "key"))
+    checkpoint = Checkpoint(str(tmp_path / "resumed.checkpoint"), "key")
+    _build(filenames, str(tmp_path / "resumed.tsv"), checkpoint, stop_after=3)
+    assert checkpoint.resume(filenames)[0] == filenames[3:]
+    _build(filenames, str(tmp_path / "resumed.tsv"), checkpoint)
+    assert (tmp_path / "resumed.tsv").read_text() == (tmp_path / "straight.tsv").read_text()
+    assert (tmp_path / "resumed.tsv.quarantine.jsonl").read_text() == (tmp_path / "straight.tsv.quarantine.jsonl").read_text()
+    assert not (tmp_path / "resumed.checkpoint").exists()
+
+def test_state_round_trip(tmp_path):
+    filenames = [str(tmp_path / f"{i}.json") for i in range(4)]
+    Checkpoint(str(tmp_path / "checkpoint"), "key").save(2, filenames[1], {"rows": 7, "emails": {"a@x.org"}})
+    todo, state = Checkpoint(str(tmp_path / "checkpoint"), "key").resume(filenames)
+    assert todo == filenames[2:]
+    assert state == {"rows": 7, "emails": {"a@x.org"}}
+
+def test_other_key_starts_over(tmp_path):
+    filenames = [str(tmp_path / f"{i}.json") for i in range(4)]
+    Checkpoint(str(tmp_path / "checkpoint"), "key").save(2, filenames[1], {})
+    assert Checkpoint(str(tmp_path / "checkpoint"), "other").resume(filenames) == (filenames, None)
+
+def test_changed_inputs_start_over(tmp_path):
+    filenames = [str(tmp_path / f"{i}.json") for i in range(4)]
+    Checkpoint(str(tmp_path / "checkpoint"), "key").save(2, filenames[1], {})
+    changed = [filenames[0]] + filenames[2:]
+    assert Checkpoint(str(tmp_path / "checkpoint"), "key").resume(changed) == (changed, None)
+    assert Checkpoint(str(tmp_path / "checkpoint"), "key").resume(filenames[:1]) == (filenames[:1], None)
@@ -0,0 +1,24 @@
+from church_store import ChurchStore
+from make_updateparishdata_spreadsheet import Church, parse_record
+
+
+def _row(last_update, email):
+    return parse_record({"id": 1, "name": "St. Mary - Parish", "email": email, "last_update": last_update}).values()
+
+def test_newest_record_wins(tmp_path):
+    with ChurchStore(str(tmp_path / "churches.sqlite"), Church.columns()) as db:
+        db.ingest("page1", "a", [_row("2024-02-01", "new@stmary.org")])
+        db.ingest("page2", "a", [_row("2024-01-01", "old@stmary.org")])
+        assert [row[3] for row in db.query()] == ["new@stmary.org"]
+
+def test_null_last_update_loses(tmp_path):
+    with ChurchStore(str(tmp_path / "churches.sqlite"), Church.columns()) as db:
+        db.ingest("page1", "a", [_row(None, "old@stmary.org")])
+        db.ingest("page2", "a", [_row("2024-01-01", "new@stmary.org")])
+        assert [row[3] for row in db.query()] == ["new@stmary.org"]
+
+def test_pending_pages(tmp_path):
+    with ChurchStore(str(tmp_path / "churches.sqlite"), Church.columns()) as db:
+        db.ingest("page1", "a", [])
+        db.ingest("page2", "b", [])
+        assert db.pending({"page1": "a", "page2": "changed", "page3": "c"}) == ["page2", "page3"]
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from make_updateparishdata_spreadsheet import ChurchDeduper, stream_churches
+from output import Quarantine
+
+
+def _record(last_update, email):
+    return {"id": 1, "name": "St. Mary - Parish", "email": email, "last_update": last_update}
+
+def _dedupe(tmp_path, policy, *records):
+    filenames = []
+    for i, record in enumerate(records):
+        path = tmp_path / f"City_page{i + 1}.json"
+        path.write_text(json.dumps([record]))
+        filenames.append(str(path))
+    deduper = ChurchDeduper(policy)
+    written = []
+    with Quarantine(str(tmp_path / "quarantine.jsonl")) as quarantine:
+        for _, churches in stream_churches(filenames, deduper, quarantine):
+            for city, church in churches:
+                church = deduper.add(church, city)
+                if church is not None:
+                    written.append(church)
+    return written + list(deduper.remaining())
+
+@pytest.mark.parametrize("policy", ChurchDeduper.POLICIES)
+def test_null_last_update(tmp_path, policy):
+    churches = _dedupe(tmp_path, policy, _record(None, "old@stmary.org"), _record("2024-01-01", "new@stmary.org"))
+    assert len(churches) == 1
+    assert churches[0].email == ("old@stmary.org" if policy == "first" else "new@stmary.org")
+
+@pytest.mark.parametrize("policy", ChurchDeduper.POLICIES)
+def test_null_last_update_after_dated(tmp_path, policy):
+    churches = _dedupe(tmp_path, policy, _record("2024-01-01", "new@stmary.org"), _record(None, "old@stmary.org"))
+    assert [church.email for church in churches] == ["new@stmary.org"]
@@ -0,0 +1,51 @@
+import os
+import pickle
+
+import pytest
+
+import exclude
+from exclude import load_exclude_emails, load_exclude_file
+
+
+def _exclude_file(tmp_path, name, emails):
+    path = tmp_path / name
+    path.write_text("name\temail\n" + "".join(f"x\t{email}\n" for email in emails))
+    return str(path)
+
+def test_index_is_reused(tmp_path):
+    path = _exclude_file(tmp_path, "a.tsv", ["A@x.org", "b@x.org "])
+    assert load_exclude_file(path) == {"a@x.org", "b@x.org"}
+    assert os.path.exists(f"{path}.idx")
+    assert load_exclude_file(path) == {"a@x.org", "b@x.org"}
+
+def test_changed_file_is_parsed_again(tmp_path):
+    path = _exclude_file(tmp_path, "a.tsv", ["a@x.org"])
+    load_exclude_file(path)
+    _exclude_file(tmp_path, "a.tsv", ["a@x.org", "longer@x.org"])
+    assert load_exclude_file(path) == {"a@x.org", "longer@x.org"}
+
+def test_unwritable_index(tmp_path, monkeypatch):
+    path = _exclude_file(tmp_path, "a.tsv", ["a@x.org"])
+    monkeypatch.setattr(exclude, "_index_path", lambda path: str(tmp_path / "missing" / "a.tsv.idx"))
+    assert load_exclude_file(path) == {"a@x.org"}
+    assert sorted(os.listdir(tmp_path)) == ["a.tsv"]
+
+def test_unreadable_index(tmp_path):
+    path = _exclude_file(tmp_path, "a.tsv", ["a@x.org"])
+    with open(f"{path}.idx", "wb") as f:
+        f.write(b"not a pickle")
+    assert load_exclude_file(path) == {"a@x.org"}
+    assert load_exclude_file(path) == {"a@x.org"}
+
+@pytest.mark.parametrize("index", [[], {"emails": ["a@x.org"]}, {"key": None, "emails": ["a@x.org"]}, {"key": (1, 2), "emails": None}, {"key": (1, 2), "emails": [None]}])
+def test_malformed_index(tmp_path, index):
+    path = _exclude_file(tmp_path, "a.tsv", ["a@x.org"])
+    with open(f"{path}.idx", "wb") as f:
+        pickle.dump(index, f)
+    assert load_exclude_file(path) == {"a@x.org"}
+    # the index was rebuilt
+    assert exclude._read_index(f"{path}.idx")[1] == ["a@x.org"]
+
+def test_several_files(tmp_path):
+    paths = [_exclude_file(tmp_path, "a.tsv", ["a@x.org"]), _exclude_file(tmp_path, "b.tsv", ["b@x.org", "a@x.org"])]
+    assert load_exclude_emails(paths) == {"a@x.org", "b@x.org"}
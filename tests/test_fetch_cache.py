@@ -0,0 +1,68 @@
+import asyncio
+import datetime
+import json
+import os
+
+from fetch_cache import FetchCache
+from fetch_pages import fetch_all
+from geocode import GeocodeCache
+from scrape_updateparishdata import PageScheduler, request_id
+
+_OLD = 1_000_000_000
+
+
+def _fetch(server, path, identifiers, output_dir, fetch_cache):
+    return asyncio.run(fetch_all(identifiers, f"{server.url}/{path}/{{}}", str(output_dir), rate=1000.0, burst=100, backoff=0.001, fetch_cache=fetch_cache))
+
+def _age(path):
+    # an mtime far in the past, so a rewrite can not go unnoticed
+    os.utime(path, (_OLD, _OLD))
+
+def test_not_modified(stand_in_server, tmp_path):
+    cache = FetchCache(str(tmp_path / "fetch_cache.sqlite"))
+    fetcher = _fetch(stand_in_server, "etag", ["a"], tmp_path, cache)
+    assert (fetcher.downloaded, fetcher.unchanged) == (1, 0)
+    _age(tmp_path / "a.html")
+    fetcher = _fetch(stand_in_server, "etag", ["a"], tmp_path, cache)
+    assert (fetcher.downloaded, fetcher.unchanged) == (0, 1)
+    assert stand_in_server.not_modified == 1
+    assert cache.unchanged == 1
+    assert os.stat(tmp_path / "a.html").st_mtime == _OLD
+
+def test_identical_body_is_not_rewritten(stand_in_server, tmp_path):
+    cache = FetchCache(str(tmp_path / "fetch_cache.sqlite"))
+    _fetch(stand_in_server, "page", ["a"], tmp_path, cache)
+    _age(tmp_path / "a.html")
+    fetcher = _fetch(stand_in_server, "page", ["a"], tmp_path, cache)
+    assert (fetcher.downloaded, fetcher.unchanged) == (0, 1)
+    assert stand_in_server.not_modified == 0
+    assert stand_in_server.requests["/page/a"] == 2
+    assert os.stat(tmp_path / "a.html").st_mtime == _OLD
+
+def test_changed_body_is_written(stand_in_server, tmp_path):
+    cache = FetchCache(str(tmp_path / "fetch_cache.sqlite"))
+    _fetch(stand_in_server, "etag", ["a"], tmp_path, cache)
+    stand_in_server.bodies["a"] = "<html><body>changed</body></html>"
+    fetcher = _fetch(stand_in_server, "etag", ["a"], tmp_path, cache)
+    assert (fetcher.downloaded, fetcher.unchanged) == (1, 0)
+    assert (tmp_path / "a.html").read_text() == "<html><body>changed</body></html>"
+
+def test_scraper_revalidates_pages(stand_in_server, tmp_path):
+    stand_in_server.bodies["page1"] = json.dumps([{"id": 1, "name": "St. Mary"}])
+    stand_in_server.bodies["page2"] = json.dumps([{"id": 2, "name": "St. Paul"}])
+    cache = FetchCache(str(tmp_path / "fetch_cache.sqlite"))
+
+    def scrape():
+        scheduler = PageScheduler(str(tmp_path), GeocodeCache(), datetime.timedelta(0), api_url=f"{stand_in_server.url}/api/", fetch_cache=cache)
+        scheduler.fetch_city("Town, NY", 40.0, -74.0)
+        return scheduler
+
+    scheduler = scrape()
+    assert (scheduler.pages_written, scheduler.pages_unchanged) == (2, 0)
+    pages = [tmp_path / request_id("Town, NY", page) for page in (1, 2)]
+    for page in pages:
+        _age(page)
+    scheduler = scrape()
+    assert (scheduler.pages_written, scheduler.pages_unchanged) == (0, 2)
+    assert stand_in_server.not_modified == 2
+    assert [os.stat(page).st_mtime for page in pages] == [_OLD, _OLD]
@@ -0,0 +1,47 @@
+import asyncio
+import os
+
+from fetch_pages import fetch_all, pending_identifiers
+from snapshot_store import SnapshotStore
+
+
+def _fetch(server, path, identifiers, **kwargs):
+    kwargs.setdefault("rate", 1000.0)
+    kwargs.setdefault("burst", 100)
+    kwargs.setdefault("backoff", 0.001)
+    return asyncio.run(fetch_all(identifiers, f"{server.url}/{path}/{{}}", **kwargs))
+
+def test_pending_skips_non_empty_pages(tmp_path):
+    (tmp_path / "done.html").write_bytes(b"<html></html>")
+    (tmp_path / "empty.html").write_bytes(b"")
+    (tmp_path / "other.txt").write_bytes(b"x")
+    assert pending_identifiers(["done", "empty", "other", "new"], str(tmp_path)) == ["empty", "other", "new"]
+
+def test_resume_only_fetches_pending(stand_in_server, tmp_path):
+    (tmp_path / "a.html").write_bytes(b"kept")
+    todo = pending_identifiers(["a", "b"], str(tmp_path))
+    fetcher = _fetch(stand_in_server, "page", todo, output_dir=str(tmp_path))
+    assert fetcher.downloaded == 1
+    assert (tmp_path / "a.html").read_bytes() == b"kept"
+    assert (tmp_path / "b.html").read_bytes() == b"<html><body>b</body></html>"
+    assert stand_in_server.requests == {"/page/b": 1}
+
+def test_retries_after_server_errors(stand_in_server, tmp_path):
+    fetcher = _fetch(stand_in_server, "fail/2", ["a"], output_dir=str(tmp_path), retries=3)
+    assert (fetcher.downloaded, fetcher.failed) == (1, 0)
+    assert stand_in_server.requests["/fail/2/a"] == 3
+    assert (tmp_path / "a.html").read_bytes() == b"<html><body>a</body></html>"
+
+def test_gives_up_after_retries(stand_in_server, tmp_path):
+    fetcher = _fetch(stand_in_server, "fail/5", ["a", "b"], output_dir=str(tmp_path), retries=2)
+    assert (fetcher.downloaded, fetcher.failed) == (0, 2)
+    assert stand_in_server.requests["/fail/5/a"] == 2
+    assert os.listdir(tmp_path) == []
+
+def test_writes_to_snapshot_store(stand_in_server, tmp_path):
+    with SnapshotStore(str(tmp_path / "store"), create=True) as store:
+        fetcher = _fetch(stand_in_server, "page", ["a", "b"], store=store, source="cpe")
+        assert fetcher.downloaded == 2
+        assert store.read("cpe", "a") == b"<html><body>a</body></html>"
+        assert store.identifiers("cpe") == ["a", "b"]
+        assert pending_identifiers(["a", "b", "c"], store=store, source="cpe") == ["c"]
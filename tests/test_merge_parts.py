@@ -0,0 +1,53 @@
+import pytest
+
+from make_updateparishdata_spreadsheet import Church
+from merge_parts import merge_parts
+
+
+def _part(tmp_path, name, header, rows):
+    path = tmp_path / name
+    path.write_text(header + "\n" + "".join("\t".join(row) + "\n" for row in rows))
+    return str(path)
+
+def _church(id, email, last_updated, english="False"):
+    church = dict.fromkeys(attribute for attribute, _ in Church.COLUMNS)
+    church.update(id=id, short_name="St. Mary", full_name="St. Mary - Parish", email=email, english=english, lat="40.5", lng="-74.0", last_updated=last_updated)
+    return [church[attribute] or "" for attribute, _ in Church.COLUMNS]
+
+def _merged(tmp_path, parts, **kwargs):
+    writer, duplicates = merge_parts(str(tmp_path / "merged.tsv"), parts, **kwargs)
+    with open(tmp_path / "merged.tsv") as f:
+        f.readline()
+        return [line.rstrip("\n").split("\t") for line in f], duplicates
+
+def test_unsorted_part_keeps_the_order_of_ties(tmp_path):
+    part = _part(tmp_path, "a.tsv", "ID\tName", [["2", "b"], ["1", "z"], ["1", "a"], ["0", "x"]])
+    rows, _ = _merged(tmp_path, [part])
+    assert rows == [["0", "x"], ["1", "z"], ["1", "a"], ["2", "b"]]
+
+def test_unique_keeps_the_first_row(tmp_path):
+    parts = [_part(tmp_path, "a.tsv", "ID\tName", [["1", "a"], ["2", "b"]]), _part(tmp_path, "b.tsv", "ID\tName", [["1", "c"], ["3", "d"]])]
+    assert _merged(tmp_path, parts, unique=True) == ([["1", "a"], ["2", "b"], ["3", "d"]], 1)
+
+@pytest.mark.parametrize("dedupe", ["newest", "merge"])
+def test_unique_keeps_the_newest_church(tmp_path, dedupe):
+    parts = [
+        _part(tmp_path, "a.tsv", Church.header(), [_church("1", "old@stmary.org", "2023-01-01"), _church("2", "", "None")]),
+        _part(tmp_path, "b.tsv", Church.header(), [_church("1", "new@stmary.org", "2024-01-01"), _church("2", "dated@stmary.org", "2024-01-01")]),
+    ]
+    rows, duplicates = _merged(tmp_path, parts, unique=True, dedupe=dedupe)
+    assert duplicates == 2
+    assert rows == [_church("1", "new@stmary.org", "2024-01-01"), _church("2", "dated@stmary.org", "2024-01-01")]
+
+def test_merge_fills_empty_fields(tmp_path):
+    parts = [
+        _part(tmp_path, "a.tsv", Church.header(), [_church("1", "old@stmary.org", "2023-01-01", english="True")]),
+        _part(tmp_path, "b.tsv", Church.header(), [_church("1", "", "2024-01-01")]),
+    ]
+    rows, _ = _merged(tmp_path, parts, unique=True, dedupe="merge")
+    assert rows == [_church("1", "old@stmary.org", "2024-01-01", english="True")]
+
+def test_newest_needs_church_parts(tmp_path):
+    part = _part(tmp_path, "a.tsv", "ID\tName", [["1", "a"]])
+    with pytest.raises(ValueError):
+        merge_parts(str(tmp_path / "merged.tsv"), [part], unique=True, dedupe="newest")
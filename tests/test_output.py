@@ -0,0 +1,32 @@
+import pytest
+
+from output import open_writer
+
+pa = pytest.importorskip("pyarrow")
+
+_COLUMNS = [("id", str), ("name", str), ("last_update", str), ("lat", float), ("count", int), ("active", bool)]
+_ROWS = [
+    [1, "St. Mary", "2024-01-02", 40.5, 3, True],
+    ["2", "St. Paul", None, None, None, None],
+]
+
+def _read(path, format):
+    if format == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_table(path)
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source).read_all()
+
+@pytest.mark.parametrize("format", ["parquet", "arrow"])
+def test_nulls_round_trip(tmp_path, format):
+    path = tmp_path / f"churches.{format}"
+    with open_writer(str(path), _COLUMNS, format) as writer:
+        for row in _ROWS:
+            writer.write(row)
+    table = _read(path, format)
+    assert table.schema.field("last_update").type == pa.string()
+    assert table.to_pylist() == [
+        {"id": "1", "name": "St. Mary", "last_update": "2024-01-02", "lat": 40.5, "count": 3, "active": True},
+        {"id": "2", "name": "St. Paul", "last_update": None, "lat": None, "count": None, "active": None},
+    ]
+    assert table.column("last_update").null_count == 1
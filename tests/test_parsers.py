@@ -0,0 +1,58 @@
+"""
+Every parser backend has to write the same spreadsheets as html.parser.
+"""
+import glob
+import os
+import warnings
+
+import pytest
+
+from conftest import FIXTURES
+import make_acpe_spreadsheet
+import make_cpe_spreadsheet
+from make_cpe_spreadsheet import Program
+from models import Contact, ProgramDetails
+from output import TsvWriter
+from parallel import file_id, sort_by_id
+from parsers import PARSERS
+
+
+def _pages(source):
+    return sort_by_id(glob.glob(os.path.join(FIXTURES, source, "*.html")))
+
+def _cpe_tsv(path, parser):
+    rejected = []
+    with TsvWriter(str(path), Program.header()) as writer:
+        for file_path in _pages("cpe"):
+            programs, file_rejected = make_cpe_spreadsheet.format_one_file(file_path, parser)
+            for program in programs:
+                writer.write([file_id(file_path), *program.values()])
+            rejected.extend(file_rejected)
+    return path.read_bytes(), rejected
+
+def _acpe_tsv(path, parser, restrict):
+    header = "\t".join(["ID", Contact.header(), ProgramDetails.header()])
+    with TsvWriter(str(path), header) as writer, warnings.catch_warnings():
+        # pages without a contacts table fall back to a full parse with a warning
+        warnings.simplefilter("ignore")
+        for file_path in _pages("acpe"):
+            for row in make_acpe_spreadsheet.format_one_file(file_path, parser, restrict):
+                writer.write(row)
+    return path.read_bytes()
+
+def test_fixtures_have_rows(tmp_path):
+    cpe, _ = _cpe_tsv(tmp_path / "cpe.tsv", "html.parser")
+    acpe = _acpe_tsv(tmp_path / "acpe.tsv", "html.parser", False)
+    assert cpe.count(b"\n") > 10
+    assert acpe.count(b"\n") > 10
+
+@pytest.mark.parametrize("parser", PARSERS)
+def test_cpe_parity(tmp_path, parser):
+    expected = _cpe_tsv(tmp_path / "expected.tsv", "html.parser")
+    assert _cpe_tsv(tmp_path / f"{parser}.tsv", parser) == expected
+
+@pytest.mark.parametrize("restrict", [False, True])
+@pytest.mark.parametrize("parser", PARSERS)
+def test_acpe_parity(tmp_path, parser, restrict):
+    expected = _acpe_tsv(tmp_path / "expected.tsv", "html.parser", False)
+    assert _acpe_tsv(tmp_path / f"{parser}.tsv", parser, restrict) == expected
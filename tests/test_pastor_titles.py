@@ -0,0 +1,93 @@
+"""
+The pastor title regex against the linear scans it replaced.
+"""
+import os
+import random
+import time
+
+import pytest
+
+from make_updateparishdata_spreadsheet import _PASTOR_TITLE_ABBREVIATIONS, _PASTOR_TITLE_WORDS, Pastor, _get_first_identity, _remove_chars, _split_titles, _startswith_title
+
+
+def _reference_startswith_title(identity):
+    lid = identity.lower()
+    # equal
+    for title in _PASTOR_TITLE_WORDS:
+        if lid == title.lower():
+            return title
+    for title in _PASTOR_TITLE_ABBREVIATIONS:
+        if lid == title.lower():
+            return title
+    # startswith
+    for title in _PASTOR_TITLE_WORDS:
+        if not lid.startswith(f"{title.lower()} "):
+            continue
+        return title
+    for title in _PASTOR_TITLE_ABBREVIATIONS:
+        if lid.startswith(f"{title.lower()} ") or lid.startswith(f"{title.lower()}."):
+            return title
+    return ""
+
+def _reference_split_titles(identity):
+    titles = []
+    while _reference_startswith_title(identity):
+        t = _reference_startswith_title(identity)
+        identity = identity[len(t):]
+        if identity.startswith("."):
+            identity = identity[1:]
+        identity = identity.strip()
+        # fix spellings
+        if t == "Farther" or t == "Fathers":
+            t = "Father"
+        if t == "(Administrator)":
+            t = "Administrator"
+        titles.append(t)
+    return " ".join(titles), identity
+
+_NAMES = ["John", "Mary Ann", "Évariste", "O'Brien", "Vincent", "Drew", "Frank", "Evan", "Reynaldo", "Deane", "Mostyn", "Dr.Who", "Rt", "Lmao", "Pbrook", "Theo", "V.", "ev", "", " "]
+_SEPARATORS = [" ", ". ", ".", "  ", "", ", ", "/", "-"]
+
+def _case(rng, text):
+    return rng.choice([text, text.lower(), text.upper(), text.capitalize(), text.swapcase()])
+
+def _names(count, seed=0):
+    rng = random.Random(seed)
+    titles = _PASTOR_TITLE_WORDS + _PASTOR_TITLE_ABBREVIATIONS
+    for _ in range(count):
+        parts = [_case(rng, rng.choice(titles)) + rng.choice(_SEPARATORS) for _ in range(rng.randint(0, 3))]
+        parts += [_case(rng, rng.choice(_NAMES)) + rng.choice(_SEPARATORS) for _ in range(rng.randint(0, 3))]
+        rng.shuffle(parts)
+        yield "".join(parts)
+
+@pytest.mark.parametrize("name", ["Farther Mike Doe", "Fathers John and Paul", "(Administrator) Ann Bee", "(administrator)", "FARTHER", "fathers.", "Rev.Msgr. Tom", "Very Rev Paul Kim", "Most Rev. Dr. Peter Paul Ray", "Vincent Paul", "V. Rev. John", "Reverendo Juan", "ev Evan", "Fr", "", "The Very Rev."])
+def test_known_names(name):
+    assert _startswith_title(name) == _reference_startswith_title(name)
+    assert _split_titles(name) == _reference_split_titles(name)
+
+def test_spellings():
+    assert _split_titles("Farther Fathers (Administrator) Mike") == ("Father Father Administrator", "Mike")
+
+def test_random_names():
+    for name in _names(50000):
+        assert _startswith_title(name) == _reference_startswith_title(name), name
+        assert _split_titles(name) == _reference_split_titles(name), name
+
+def test_random_pastors():
+    for name in _names(5000, seed=1):
+        pastor = Pastor(name)
+        title, names_text = _reference_split_titles(_remove_chars(_get_first_identity(name), "?:+").strip())
+        assert (pastor.title, pastor.names_text) == (title, names_text.strip()), name
+
+@pytest.mark.skipif(not os.environ.get("RUN_BENCHMARKS"), reason="set RUN_BENCHMARKS=1 to run the microbenchmarks")
+def test_split_titles_speed():
+    names = list(_names(100000, seed=2))
+    timings = {}
+    for func in (_reference_split_titles, _split_titles):
+        start = time.perf_counter()
+        for name in names:
+            func(name)
+        timings[func.__name__] = time.perf_counter() - start
+    for name, seconds in timings.items():
+        print(f"{name}: {len(names) / seconds:,.0f} names/s")
+    assert timings["_split_titles"] < timings["_reference_split_titles"]
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+import make_updateparishdata_spreadsheet
+from make_updateparishdata_spreadsheet import ChurchDeduper, format_one_file, stream_churches
+from output import Quarantine
+
+
+@pytest.fixture(params=["ijson", "json"])
+def reader(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(make_updateparishdata_spreadsheet, "ijson", None)
+    elif make_updateparishdata_spreadsheet.ijson is None:
+        pytest.skip("ijson is not installed")
+    return request.param
+
+def _pages(tmp_path):
+    good = tmp_path / "Town_page1.json"
+    good.write_text(json.dumps([{"id": 1, "name": "St. Mary - Parish"}, {"id": 2, "name": "St. Paul", "bogus": 1}]))
+    truncated = tmp_path / "Town_page2.json"
+    truncated.write_text(json.dumps([{"id": 3, "name": "St. John"}, {"id": 4, "name": "St. Luke"}])[:-20])
+    invalid = tmp_path / "Town_page3.json"
+    invalid.write_text("<html>502 Bad Gateway</html>")
+    last = tmp_path / "Village_page1.json"
+    last.write_text(json.dumps([{"id": 5, "name": "St. Anne"}]))
+    return [str(good), str(truncated), str(invalid), str(last)]
+
+def _quarantined(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def test_bad_pages_are_quarantined(tmp_path, reader):
+    filenames = _pages(tmp_path)
+    ids = []
+    with Quarantine(str(tmp_path / "quarantine.jsonl")) as quarantine:
+        for _, churches in stream_churches(filenames, ChurchDeduper(), quarantine):
+            ids.extend(church.id for _, church in churches)
+    # the run carries on after the bad pages
+    assert 1 in ids and 5 in ids
+    assert 4 not in ids
+    entries = _quarantined(tmp_path / "quarantine.jsonl")
+    assert [(entry["source"], entry["record"]) for entry in entries] == [(filenames[0], {"id": 2, "name": "St. Paul", "bogus": 1}), (filenames[1], None), (filenames[2], None)]
+    assert entries[1]["reason"].startswith("Could not read the page")
+
+def test_format_one_file_rejects_bad_pages(tmp_path, reader):
+    filenames = _pages(tmp_path)
+    churches, rejected = format_one_file(filenames[2])
+    assert churches == []
+    assert [record for _, record in rejected] == [None]
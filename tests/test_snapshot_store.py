@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from snapshot_store import SnapshotStore, import_files
+
+
+def test_put_read_as_of(tmp_path):
+    path = str(tmp_path / "store")
+    with SnapshotStore(path, create=True) as store:
+        store.put("cpe", "prog1", b"first", fetched_at=100.0)
+        store.put("cpe", "prog1", b"second", fetched_at=200.0)
+        store.put("cpe", "prog2", b"first", fetched_at=150.0)
+        store.put("acpe", "00001", b"other source", fetched_at=100.0)
+        assert (store.written, store.deduplicated) == (3, 1)
+    with SnapshotStore(path) as store:
+        assert store.read("cpe", "prog1") == b"second"
+        assert store.read("cpe", "prog1", as_of=199.0) == b"first"
+        assert store.read("cpe", "prog2") == b"first"
+        assert store.digest("cpe", "prog2") == store.digest("cpe", "prog1", as_of=100.0)
+        assert store.identifiers("cpe") == ["prog1", "prog2"]
+        assert store.identifiers("cpe", as_of=120.0) == ["prog1"]
+        assert store.identifiers("cpe", "prog2*") == ["prog2"]
+        with pytest.raises(KeyError):
+            store.read("cpe", "prog2", as_of=120.0)
+        with pytest.raises(KeyError):
+            store.read("acpe", "prog1")
+
+def test_read_while_writing(tmp_path):
+    with SnapshotStore(str(tmp_path / "store"), create=True) as store:
+        store.put("cpe", "prog1", b"body")
+        assert store.read("cpe", "prog1") == b"body"
+        store.put("cpe", "prog2", b"x" * 100000)
+        assert store.read("cpe", "prog2") == b"x" * 100000
+
+def test_missing_store(tmp_path):
+    with pytest.raises(ValueError):
+        SnapshotStore(str(tmp_path / "mistyped"))
+    assert not os.path.exists(tmp_path / "mistyped")
+    with pytest.raises(ValueError):
+        SnapshotStore(str(tmp_path))
+
+def test_import_files(tmp_path):
+    (tmp_path / "pages").mkdir()
+    for name in ("prog2.html", "prog10.html"):
+        (tmp_path / "pages" / name).write_text(f"<html>{name}</html>")
+    os.utime(tmp_path / "pages" / "prog10.html", (1000, 1000))
+    with SnapshotStore(str(tmp_path / "store"), create=True) as store:
+        assert import_files(store, "cpe", str(tmp_path / "pages" / "*.html")) == 2
+        assert store.identifiers("cpe") == ["prog10", "prog2"]
+        assert store.read("cpe", "prog10", as_of=1000) == b"<html>prog10.html</html>"
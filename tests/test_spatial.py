@@ -0,0 +1,79 @@
+"""
+The grid of the spatial index against a brute force haversine scan.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from spatial import SpatialIndex, haversine_km
+
+
+def _points(rng, count):
+    """
+    A mix of points anywhere, near the poles and on both sides of the antimeridian.
+    """
+    lats = np.degrees(np.arcsin(rng.uniform(-1, 1, count)))
+    lngs = rng.uniform(-180, 180, count)
+    kind = rng.integers(0, 4, count)
+    polar = kind == 1
+    lats[polar] = rng.choice([-1, 1], polar.sum()) * rng.uniform(85, 90, polar.sum())
+    antimeridian = kind == 2
+    lngs[antimeridian] = rng.choice([-1, 1], antimeridian.sum()) * rng.uniform(175, 180, antimeridian.sum())
+    lats[:4] = [90, -90, 0, 45]
+    lngs[:4] = [0, 123, 180, -180]
+    return lats, lngs
+
+def _brute_force(lats, lngs, query_lats, query_lngs):
+    return haversine_km(np.radians(query_lats), np.radians(query_lngs), np.radians(lats), np.radians(lngs))
+
+@pytest.mark.parametrize("cell_km", [25.0, 300.0])
+@pytest.mark.parametrize("radius_km", [5.0, 25.0, 120.0, 2000.0])
+def test_within(cell_km, radius_km):
+    rng = np.random.default_rng(int(cell_km + radius_km))
+    lats, lngs = _points(rng, 3000)
+    query_lats, query_lngs = _points(rng, 400)
+    index = SpatialIndex(lats, lngs, cell_km)
+    matrix = _brute_force(lats, lngs, query_lats, query_lngs)
+    for row, (indices, distances) in zip(matrix, index.within(query_lats, query_lngs, radius_km)):
+        assert sorted(indices) == sorted(np.flatnonzero(row <= radius_km))
+        assert np.allclose(distances, row[indices])
+        assert np.all(np.diff(distances) >= 0)
+
+@pytest.mark.parametrize("cell_km", [25.0, 300.0])
+@pytest.mark.parametrize("k", [1, 5])
+def test_nearest(cell_km, k):
+    rng = np.random.default_rng(int(cell_km) + k)
+    lats, lngs = _points(rng, 2000)
+    query_lats, query_lngs = _points(rng, 400)
+    index = SpatialIndex(lats, lngs, cell_km)
+    matrix = _brute_force(lats, lngs, query_lats, query_lngs)
+    indices, distances = index.nearest(query_lats, query_lngs, k)
+    assert np.allclose(distances, np.sort(matrix, axis=1)[:, :k])
+    assert np.allclose(np.take_along_axis(matrix, indices, axis=1), distances)
+
+def test_query_across_the_antimeridian():
+    index = SpatialIndex([10.0, 10.0, 10.0], [179.9, -179.9, 0.0])
+    indices, distances = index.within([10.0], [180.0], 30.0)[0]
+    assert sorted(indices) == [0, 1]
+    assert index.nearest([10.0], [-179.95], 2)[0][0].tolist() == [1, 0]
+
+def test_query_at_a_pole():
+    # every longitude is close to the pole
+    index = SpatialIndex([89.9, 89.9, -89.9, 0.0], [0.0, 180.0, 90.0, 0.0])
+    assert sorted(index.within([90.0], [-45.0], 30.0)[0][0]) == [0, 1]
+    assert index.within([-90.0], [0.0], 30.0)[0][0].tolist() == [2]
+
+def test_few_points():
+    index = SpatialIndex([40.0], [-74.0])
+    indices, distances = index.nearest([-40.0, 0.0], [106.0, 0.0], 3)
+    assert indices.tolist() == [[0, -1, -1], [0, -1, -1]]
+    assert np.isinf(distances[:, 1:]).all()
+    assert np.isclose(distances[0, 0], np.pi * 6371.0088)
+
+def test_empty_index():
+    index = SpatialIndex([], [])
+    assert [indices.tolist() for indices, _ in index.within([0.0, 90.0], [180.0, 0.0], 100.0)] == [[], []]
+    indices, distances = index.nearest([0.0], [0.0], 2)
+    assert indices.tolist() == [[-1, -1]]
+    assert np.isinf(distances).all()
+    assert index.within([], [], 100.0) == []